@@ -1,240 +1,543 @@
 import os
+import io
+import sys
+import json
+import queue
+import multiprocessing
+import threading
+import zlib
 import numpy as np
-import jsonpickle
 import tarfile
 import re
-import shutil
 from tqdm.auto import tqdm
 
+# record_codec is shared with the writer in token_graph_data
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'token_graph_data'))
+from record_codec import K_FIELDS, decode_record, dumps
+from columnar_store import ColumnarStore, open_sidecar, records_to_columns
+
 TOL = 1e-8
+# Archive streaming: read size of the (chained) archive files, and decoded batches kept ahead of testing
+ARCHIVE_READ_BYTES = 1 << 20
+ARCHIVE_PREFETCH_BATCHES = 8
+# Graphs per unit of work of run_all_conjecture_tests (rounded up to whole batches)
+CHUNK_GRAPHS = 20000
+
+WORST_CASE_KEYS = (
+    'QMC_max(MATCH,CUT)/OPT',
+    'QMC_max(MATCH,.956*CUT)/OPT',
+    'XY_max(MATCH,CUT)/OPT',
+    'XY_max(MATCH,.935*CUT)/OPT',
+    'XY_max(MATCH,CUT)_apx',
+    'XY_max(MATCH,.935*CUT)_apx',
+)
+
+# Message templates of the conditions checked at every k, in the order they are reported.
+CONJECTURE_MESSAGES = (
+    "Lk <= (W+C)/2+Mk failed at k={k}.",
+    "Lk <= W+Mk failed at k={k}.",
+    "Qk <= W+Mk failed at k={k}.",
+    " -Ak <= C/2+Mk/2 failed at k={k}.",
+    "Ak <= W/2+Mk/2 failed at k={k}.",
+    "Lk monotonicity failed at k={k}.",
+    "Qk monotonicity failed at k={k}.",
+    "Ak monotonicity failed at k={k}.",
+)
 
-def stream_results_in_batches(filename, batch_size):
+def evaluate_conjectures(n, W, C, M, k_data):
     """
-    Generate batches of results from a file.
+    Test the conjectures on many graphs at once, vectorized over graphs and k.
 
     Parameters:
-    - filename: str - the name of the file to read from
-    - batch_size: int - the number of results in each batch
+    - n: array (graphs,) - number of vertices
+    - W, C, M: arrays (graphs,) - graph invariants
+    - k_data: array (graphs, max_k, 8) - per k = 1..max_k the K_FIELDS columns
+      (M_le_k, C_k, A/L/Q min and max); entries past n // 2 are ignored
 
-    Yields:
-    - List of results as decoded from jsonpickle
+    Returns:
+    - failures: dict - row -> list of failure messages (by k, then in
+      CONJECTURE_MESSAGES order), only for graphs that fail a conjecture
+    - ratios: dict - WORST_CASE_KEYS -> minimum ratio over the graphs (inf if none)
     """
-    batch = []
-    with open(filename, 'r') as f:
-        for line in f:
-            result = jsonpickle.decode(line.strip())
-            batch.append(result)
-            if len(batch) == batch_size:
-                yield batch
-                batch = []
-        if batch:
-            yield batch
-
-def test_conjectures(data, worst_case_approx_dict=None, output_filename='failing_conjecture_graphs.jsonl'):
-    """
-    Test conjectures for token graphs. Print failures and store failing graphs with reasons.
-    """
-    W, C, M = data['graph_invariants']['W'], data['graph_invariants']['C'], data['graph_invariants']['M']
-    n = len(data['graph']['nodes'])
-    prev_Lk_max, prev_Qk_max, prev_Ak_max, prev_nAk_max = -np.inf, -np.inf, -np.inf, -np.inf
-    L_max, A_max, nA_max = -np.inf, -np.inf, -np.inf
-    prev_Mk, prev_Ck = 0, 0
-    failing_conjectures = []
-
-    for k in range(1, n // 2 + 1):
-        Ak_max = data['k_data'][str(k)]['spec']['A']['max']
-        nAk_max = -data['k_data'][str(k)]['spec']['A']['min']
-        Lk_max = data['k_data'][str(k)]['spec']['L']['max']
-        Qk_max = data['k_data'][str(k)]['spec']['Q']['max']
-        Mk = data['k_data'][str(k)]['M_le_k'] 
-        Ck = data['k_data'][str(k)]['C_k']
-
-        conditions = [
-            (Lk_max <= (W + C) / 2 + Mk + TOL, f"Lk <= (W+C)/2+Mk failed at k={k}."),
-            (Lk_max <= W + Mk + TOL, f"Lk <= W+Mk failed at k={k}."),
-            (Qk_max <= W + Mk + TOL, f"Qk <= W+Mk failed at k={k}."),
-            (nAk_max <= C / 2 + Mk / 2 + TOL, f" -Ak <= C/2+Mk/2 failed at k={k}."),
-            (Ak_max <= W / 2 + Mk / 2 + TOL, f"Ak <= W/2+Mk/2 failed at k={k}."),
-            (Lk_max >= prev_Lk_max - TOL, f"Lk monotonicity failed at k={k}."),
-            (Qk_max >= prev_Qk_max - TOL, f"Qk monotonicity failed at k={k}."),
-            (Ak_max >= prev_Ak_max - TOL, f"Ak monotonicity failed at k={k}."),
-        ]
-        for condition, message in conditions:
-            if not condition:
-                print(message)
-                failing_conjectures.append(message)
-
-        L_max, A_max, nA_max = max(L_max, Lk_max), max(A_max, Ak_max), max(nA_max, nAk_max)
-        prev_Lk_max, prev_Qk_max, prev_Ak_max, prev_nAk_max = Lk_max, Qk_max, Ak_max, nAk_max
-
-    # track worst case approximations
+    n = np.asarray(n)
+    W, C, M = (np.asarray(x, dtype=np.float64)[:, None] for x in (W, C, M))
+    k_data = np.asarray(k_data, dtype=np.float64)
+    column = {field: k_data[:, :, i] for i, field in enumerate(K_FIELDS)}
+    Mk, Ak_max, Lk_max, Qk_max = column['M_le_k'], column['A_max'], column['L_max'], column['Q_max']
+    nAk_max = -column['A_min']
+    valid = np.arange(k_data.shape[1])[None, :] < (n // 2)[:, None]
+
+    def previous(x):
+        return np.concatenate([np.full((len(x), 1), -np.inf), x[:, :-1]], axis=1)
+
+    with np.errstate(invalid='ignore'):
+        holds = np.stack([
+            Lk_max <= (W + C) / 2 + Mk + TOL,
+            Lk_max <= W + Mk + TOL,
+            Qk_max <= W + Mk + TOL,
+            nAk_max <= C / 2 + Mk / 2 + TOL,
+            Ak_max <= W / 2 + Mk / 2 + TOL,
+            Lk_max >= previous(Lk_max) - TOL,
+            Qk_max >= previous(Qk_max) - TOL,
+            Ak_max >= previous(Ak_max) - TOL,
+        ], axis=-1)
+    fails = ~holds & valid[:, :, None]
+
+    failures = {}
+    for row in np.flatnonzero(fails.any(axis=(1, 2))):
+        failures[int(row)] = [CONJECTURE_MESSAGES[c].format(k=k + 1) for k, c in np.argwhere(fails[row])]
+
+    L_max, A_max, nA_max = (np.max(np.where(valid, x, -np.inf), axis=1, initial=-np.inf)
+                            for x in (Lk_max, Ak_max, nAk_max))
+    W, C, M = W[:, 0], C[:, 0], M[:, 0]
     match_energy_qmc = (3 * M + W) / 2
     match_energy_xy = M + W/2
-    cut_energy_qmc = C
-    cut_energy_xy =C 
-    xy_max, xy_min = nA_max+W/2, -A_max+W/2
-    if worst_case_approx_dict is not None:
-        worst_case_approx_dict['QMC_max(MATCH,CUT)/OPT'] = min(worst_case_approx_dict['QMC_max(MATCH,CUT)/OPT'], max(match_energy_qmc, cut_energy_qmc)/L_max)
-        worst_case_approx_dict['QMC_max(MATCH,.956*CUT)/OPT'] = min(worst_case_approx_dict['QMC_max(MATCH,.956*CUT)/OPT'], max(match_energy_qmc, .956*cut_energy_qmc)/L_max)
-        worst_case_approx_dict['XY_max(MATCH,CUT)/OPT'] = min(worst_case_approx_dict['XY_max(MATCH,CUT)/OPT'], max(match_energy_xy, cut_energy_xy) / xy_max)
-        worst_case_approx_dict['XY_max(MATCH,.935*CUT)/OPT'] = min(worst_case_approx_dict['XY_max(MATCH,.935*CUT)/OPT'], max(match_energy_xy, .9349*cut_energy_xy) /xy_max)
-        worst_case_approx_dict['XY_max(MATCH,CUT)_apx'] = min(worst_case_approx_dict['XY_max(MATCH,CUT)_apx'], (max(match_energy_xy, cut_energy_xy) - xy_min) / (xy_max - xy_min))
-        worst_case_approx_dict['XY_max(MATCH,.935*CUT)_apx'] = min(worst_case_approx_dict['XY_max(MATCH,.935*CUT)_apx'], (max(match_energy_xy, .9349*cut_energy_xy) - xy_min) / (xy_max - xy_min))
-    
-    # Save failing data if any conjectures failed
-    if failing_conjectures:
-        data['failing_conjectures'] = failing_conjectures
-        with open(output_filename, 'a') as f:
-            f.write(jsonpickle.encode(data) + "\n")
-
-def safe_tarinfo_filter(tarinfo, path):
-    """
-    A secure tar filter that prevents extraction of absolute paths
-    or paths with '..' to avoid path traversal vulnerabilities.
+    xy_max, xy_min = nA_max + W/2, -A_max + W/2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        worst = np.stack([
+            np.maximum(match_energy_qmc, C) / L_max,
+            np.maximum(match_energy_qmc, .956 * C) / L_max,
+            np.maximum(match_energy_xy, C) / xy_max,
+            np.maximum(match_energy_xy, .9349 * C) / xy_max,
+            (np.maximum(match_energy_xy, C) - xy_min) / (xy_max - xy_min),
+            (np.maximum(match_energy_xy, .9349 * C) - xy_min) / (xy_max - xy_min),
+        ])
+    # fmin skips NaN ratios, as min(best, ratio) with the builtin min would
+    ratios = dict(zip(WORST_CASE_KEYS, np.fmin.reduce(worst, axis=1, initial=np.inf).tolist()))
+    return failures, ratios
 
-    Parameters:
-    - tarinfo: TarInfo - Tarfile metadata
-    - path: str - Path to extract to
+class PartialResult:
+    """
+    The outcome of testing part of the data: per-metric minimum ratios, plus
+    the messages to print and failing graphs to store, in order. Partials
+    are computed independently (possibly in worker processes) and merged into
+    the totals with merge_into in a fixed order.
+    """
 
-    Returns:
-    - Modified TarInfo object or None if unsafe
+    def __init__(self):
+        self.ratios = {key: np.inf for key in WORST_CASE_KEYS}
+        self.events = []        # ('print', message) or ('write', output line)
+        self.members = []       # archive members tested
+        self.error = None       # message that stopped the test of a file
+
+    def add(self, failures, ratios, record):
+        """Add evaluate_conjectures results; record(row) is the decoded record of a failing row."""
+        for key, ratio in ratios.items():
+            self.ratios[key] = min(self.ratios[key], ratio)
+        for row, messages in failures.items():
+            data = record(row)
+            data['failing_conjectures'] = messages
+            self.events.extend(('print', message) for message in messages)
+            self.events.append(('write', dumps(data).decode() + "\n"))
+
+    def note(self, message):
+        self.events.append(('print', message))
+
+    def merge_into(self, worst_case_approx_dict=None, output_filename='failing_conjecture_graphs.jsonl'):
+        """Fold the ratios into worst_case_approx_dict, print the messages and store the failing graphs."""
+        if worst_case_approx_dict is not None:
+            for key, ratio in self.ratios.items():
+                worst_case_approx_dict[key] = min(worst_case_approx_dict[key], ratio)
+        lines = []
+        for kind, text in self.events:
+            if kind == 'print':
+                print(text)
+            else:
+                lines.append(text)
+        if lines:
+            with open(output_filename, 'a') as f:
+                f.writelines(lines)
+
+def test_batch_partial(batch, partial):
+    """Evaluate a batch of decoded records (either layout) into partial."""
+    columns = records_to_columns(batch)
+    failures, ratios = evaluate_conjectures(columns['n'], columns['W'], columns['C'], columns['M'], columns['k_data'])
+    partial.add(failures, ratios, lambda row: batch[row])
+
+def test_conjectures_batch(batch, worst_case_approx_dict=None, output_filename='failing_conjecture_graphs.jsonl'):
     """
-    if tarinfo.name.startswith('/') or '..' in tarinfo.name.split('/'):
-        print(f"Skipping unsafe file in tar: {tarinfo.name}")
-        return None
-    return tarinfo
+    Test the conjectures on a batch of decoded records (either layout) with
+    evaluate_conjectures. Prints and stores failures in batch order.
+    """
+    partial = PartialResult()
+    test_batch_partial(batch, partial)
+    partial.merge_into(worst_case_approx_dict, output_filename)
 
-def untar_file(tar_path, extract_to):
+def test_store_partial(store, source_path, partial, start=0, end=None):
+    """
+    Evaluate rows start..end of a columnar store (see token_graph_data/columnar_store)
+    into partial, straight from the memory-mapped arrays. Failing graphs are
+    re-read from their lines in source_path so they are stored exactly as the
+    JSONL path stores them.
     """
-    Extracts a tar file safely and returns a list of extracted .jsonl files.
+    end = len(store) if end is None else end
+    shard_start = 0
+    with open(source_path, 'rb') as source:
+        for shard in store.shards():
+            shard_end = shard_start + len(shard['n'])
+            lo, hi = max(start, shard_start) - shard_start, min(end, shard_end) - shard_start
+            shard_start = shard_end
+            if lo >= hi:
+                continue
+            offsets = shard['offsets'][lo:hi]
 
-    Parameters:
-    - tar_path: str - Path to the tar file
-    - extract_to: str - Directory to extract to
+            def record(row):
+                source.seek(int(offsets[row]))
+                return decode_record(source.readline())
 
-    Returns:
-    - List of extracted .jsonl file paths
+            columns = [shard[name][lo:hi] for name in ('n', 'W', 'C', 'M', 'k_data')]
+            partial.add(*evaluate_conjectures(*columns), record)
+
+def test_conjectures_store(store, source_path, worst_case_approx_dict=None,
+                           output_filename='failing_conjecture_graphs.jsonl'):
+    """test_conjectures_batch for a whole columnar store; see test_store_partial."""
+    partial = PartialResult()
+    test_store_partial(store, source_path, partial)
+    partial.merge_into(worst_case_approx_dict, output_filename)
+
+def test_lines_partial(filepath, start, end, batch_size, partial):
+    """
+    Decode and evaluate the lines of a .jsonl file between byte offsets start
+    and end, batch_size at a time, into partial. Stops at the first error and
+    records it in partial.error.
     """
-    extracted_jsonls = []
     try:
-        with tarfile.open(tar_path, 'r:*') as tar:
-            members = tar.getmembers()
-            tar.extractall(path=extract_to, filter=safe_tarinfo_filter)
-            print(f'Untarred: {tar_path}')
-            for member in members:
-                if member.name.endswith('.jsonl'):
-                    extracted_jsonls.append(os.path.join(extract_to, member.name))
-    except tarfile.ReadError:
-        print(f'Failed to untar: {tar_path}')
-    return extracted_jsonls
+        batch = []
+        with open(filepath, 'rb') as f:
+            f.seek(start)
+            while f.tell() < end:
+                batch.append(decode_record(f.readline()))
+                if len(batch) == batch_size:
+                    test_batch_partial(batch, partial)
+                    batch = []
+        if batch:
+            test_batch_partial(batch, partial)
+    except Exception as e:
+        partial.error = f"Error processing {filepath}: {e}"
+
+class ChainedReader(io.RawIOBase):
+    """
+    Read-only stream over several files as if they were concatenated, so the
+    parts of a split archive can be read without joining them on disk.
+    """
+
+    def __init__(self, paths):
+        self._paths = list(paths)
+        self._file = None
+
+    def readable(self):
+        return True
 
-def concatenate_split_parts(part_files, output_path):
+    def readinto(self, buffer):
+        while True:
+            if self._file is None:
+                if not self._paths:
+                    return 0
+                self._file = open(self._paths.pop(0), 'rb')
+            n = self._file.readinto(buffer)
+            if n:
+                return n
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+def stream_archive_batches(archive_paths, batch_size):
     """
-    Concatenates multiple part files into a single .tar.gz file.
+    Generate batches of results from the .jsonl members of a tar archive,
+    decompressed and decoded on the fly without extracting anything.
 
     Parameters:
-    - part_files: list of str - paths to split .part files
-    - output_path: str - path where the combined file will be written
+    - archive_paths: list of str - the archive, or the parts of a split archive
+      in order
+    - batch_size: int - the number of results in each batch
+
+    Yields:
+    - (member name, list of at most batch_size results as decoded by
+      record_codec.decode_record, in the verbose layout), or
+      (member name, exception) if a line of that member could not be decoded,
+      after which the rest of the member is skipped
     """
-    with open(output_path, 'wb') as outfile:
-        for part in sorted(part_files):
-            with open(part, 'rb') as infile:
-                shutil.copyfileobj(infile, outfile)
+    stream = io.BufferedReader(ChainedReader(archive_paths), buffer_size=ARCHIVE_READ_BYTES)
+    with stream, tarfile.open(fileobj=stream, mode='r|*') as tar:
+        for member in tar:
+            if not (member.isfile() and member.name.endswith('.jsonl')):
+                continue
+            batch = []
+            try:
+                for line in tar.extractfile(member):
+                    batch.append(decode_record(line))
+                    if len(batch) == batch_size:
+                        yield member.name, batch
+                        batch = []
+            except (ValueError, KeyError, TypeError) as e:
+                yield member.name, e
+                continue
+            if batch:
+                yield member.name, batch
 
+def prefetch(iterable, depth):
+    """
+    Iterate over iterable in a background thread, at most depth items ahead of
+    the consumer (archive decompression then overlaps with testing). Exceptions
+    are re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
 
-def run_all_conjecture_tests(root='token_graph_data/data', 
-                             batch_size=100, 
-                             output_filename='failing_conjecture_graphs.jsonl', 
-                             process_tarred_files=True
-                             ):
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+def test_archive_partial(archive_paths, batch_size, partial, archive=None):
     """
-    Recursively runs test_conjectures on all .jsonl files found under the root directory.
-    - Handles both regular and nested subdirectories.
-    - Automatically untars .tar.gz files.
-    - Reconstructs and untars split archives like .tar.gz.part00.part, .part01.part, etc.
-    - Tracks and deletes all .jsonl files that were originally extracted from tarballs.
+    Evaluate every .jsonl member of a (split) tar archive into partial,
+    streamed with stream_archive_batches and decoded in a background thread.
+    A member that cannot be decoded or tested is reported and skipped, an
+    unreadable archive is reported; partial.members lists the members seen.
+    """
+    archive = archive or archive_paths[0]
+    failed_member = None
+    try:
+        for name, batch in prefetch(stream_archive_batches(archive_paths, batch_size), ARCHIVE_PREFETCH_BATCHES):
+            if not partial.members or partial.members[-1] != name:
+                partial.members.append(name)
+            if name == failed_member:
+                continue
+            try:
+                if isinstance(batch, Exception):
+                    raise batch
+                test_batch_partial(batch, partial)
+            except Exception as e:
+                partial.note(f"Error processing {name} in {archive}: {e}")
+                failed_member = name
+    except (tarfile.TarError, EOFError, OSError, zlib.error) as e:
+        partial.note(f'Failed to read archive: {archive} ({e})')
 
-    Parameters:
-    - root: str - root directory to start searching
-    - batch_size: int - batch size to use with stream_results_in_batches
-    - output_filename: str - file to write failing conjectures to
-    - process_tarred_files: bool - whether to process tarred files (bigger files leads to heavier computation)
+def test_conjectures_archive(archive_paths, worst_case_approx_dict=None,
+                             output_filename='failing_conjecture_graphs.jsonl', batch_size=100):
     """
-    worst_case_approx_dict = {
-        'QMC_max(MATCH,CUT)/OPT': 1,
-        'QMC_max(MATCH,.956*CUT)/OPT': 1,
-        'XY_max(MATCH,CUT)/OPT': 1,
-        'XY_max(MATCH,.935*CUT)/OPT': 1,
-        'XY_max(MATCH,CUT)_apx': 1,
-        'XY_max(MATCH,.935*CUT)_apx': 1,
-    }
-    # keep track of extracted jsonl files and combined tar files to delete later (maintains directory size for github)
-    extracted_jsonl_files = set()
-    combined_tar_files = set()
+    test_conjectures_batch over every .jsonl member of a (split) tar archive;
+    see test_archive_partial.
 
-    # delete the output file if it exists
-    if os.path.exists(output_filename):
-        os.remove(output_filename)
+    Returns:
+    - Names of the members that were tested
+    """
+    partial = PartialResult()
+    test_archive_partial(archive_paths, batch_size, partial)
+    partial.merge_into(worst_case_approx_dict, output_filename)
+    return partial.members
 
-    # walk through the directory tree
+def line_chunks(filepath, chunk_lines):
+    """(start, end) byte offsets of consecutive runs of chunk_lines lines of a file."""
+    chunks, start, offset, lines = [], 0, 0, 0
+    with open(filepath, 'rb') as f:
+        for line in f:
+            offset += len(line)
+            lines += 1
+            if lines == chunk_lines:
+                chunks.append((start, offset))
+                start, lines = offset, 0
+    if lines:
+        chunks.append((start, offset))
+    return chunks
+
+def build_sidecar(args):
+    """Pool task: (filepath, sidecar directory, rows) or (filepath, None, message) if there is none."""
+    filepath, sidecar_dir = args
+    try:
+        store = open_sidecar(filepath, sidecar_dir)
+    except Exception as e:
+        return filepath, None, f"No sidecar for {filepath} ({e}); decoding it directly"
+    return filepath, str(store.directory), len(store)
+
+def run_unit(unit):
+    """Pool task: the PartialResult of one unit of work planned by run_all_conjecture_tests."""
+    kind, args = unit
+    partial = PartialResult()
+    if kind == 'archive':
+        archive, paths, batch_size = args
+        test_archive_partial(paths, batch_size, partial, archive)
+    elif kind == 'store':
+        directory, filepath, start, end = args
+        test_store_partial(ColumnarStore(directory), filepath, partial, start, end)
+    elif kind == 'lines':
+        filepath, start, end, batch_size = args
+        test_lines_partial(filepath, start, end, batch_size, partial)
+    return partial
+
+def plan_units(root, batch_size, chunk_size, process_tarred_files, sidecar_dir, pool):
+    """
+    Units of work for run_all_conjecture_tests, in the order a serial run tests
+    them, each with (kind, directory, file, notes) for merging: one unit per
+    archive and one per chunk of chunk_size graphs (whole batches) of a .jsonl.
+    """
+    part_pattern = re.compile(r'(.*\.tar\.gz)\.part\d+\.part')
+    chunk_lines = -(-chunk_size // batch_size) * batch_size
+    dirpaths, archives, files = [], [], []
     for dirpath, dirnames, filenames in os.walk(root):
+        dirpaths.append(dirpath)
         filenames = sorted(filenames)
-        part_pattern = re.compile(r'(.*\.tar\.gz)\.part\d+\.part')
-        grouped_parts = {}
-
         if process_tarred_files:
+            grouped_parts = {}
             for filename in filenames:
                 match = part_pattern.match(filename)
                 if match:
                     base = match.group(1)
                     grouped_parts.setdefault(base, []).append(os.path.join(dirpath, filename))
+            archives += [(dirpath, os.path.join(dirpath, os.path.basename(base)), sorted(parts))
+                         for base, parts in grouped_parts.items()]
+            archives += [(dirpath, os.path.join(dirpath, filename), [os.path.join(dirpath, filename)])
+                         for filename in filenames
+                         if filename.endswith('.tar.gz') and not part_pattern.match(filename)]
+        files += [(dirpath, os.path.join(dirpath, filename))
+                  for filename in os.listdir(dirpath) if filename.endswith('.jsonl')]
 
-            for base, parts in grouped_parts.items():
-                combined_path = os.path.join(dirpath, os.path.basename(base))
-                concatenate_split_parts(parts, combined_path)
-                combined_tar_files.add(combined_path)
-                extracted = untar_file(combined_path, dirpath)
-                extracted_jsonl_files.update(extracted)
+    sidecars = {}
+    if sidecar_dir is not None and files:
+        tasks = [(filepath, sidecar_dir) for _, filepath in files]
+        for filepath, directory, info in (pool.imap(build_sidecar, tasks) if pool else map(build_sidecar, tasks)):
+            sidecars[filepath] = directory, info
 
-            for filename in filenames:
-                if filename.endswith('.tar.gz') and not part_pattern.match(filename):
-                    tar_path = os.path.join(dirpath, filename)
-                    extracted = untar_file(tar_path, dirpath)
-                    extracted_jsonl_files.update(extracted)
-
-        for filename in os.listdir(dirpath):
-            if filename.endswith('.jsonl'):
-                filepath = os.path.join(dirpath, filename)
+    units = []
+    for dirpath in dirpaths:
+        for archive_dir, archive, paths in archives:
+            if archive_dir == dirpath:
+                units.append((('archive', (archive, paths, batch_size)), ('archive', dirpath, archive, [])))
+        for file_dir, filepath in files:
+            if file_dir != dirpath:
+                continue
+            notes = []
+            directory, info = sidecars.get(filepath, (None, None))
+            if directory is not None:
+                chunks = [('store', (directory, filepath, start, min(start + chunk_lines, info)))
+                          for start in range(0, info, chunk_lines)]
+            else:
+                if info is not None:
+                    notes.append(info)
                 try:
-                    with open(filepath, 'r') as f:
-                        total_lines = sum(1 for _ in f)
+                    chunks = [('lines', (filepath, start, end, batch_size))
+                              for start, end in line_chunks(filepath, chunk_lines)]
+                except OSError as e:
+                    notes.append(f"Error processing {filepath}: {e}")
+                    chunks = []
+            for unit in chunks or [None]:
+                units.append((unit, ('file', dirpath, filepath, notes)))
+                notes = []
+    return units
+
+
+def run_all_conjecture_tests(root='token_graph_data/data', 
+                             batch_size=100, 
+                             output_filename='failing_conjecture_graphs.jsonl', 
+                             process_tarred_files=True,
+                             sidecar_dir='.conjecture_cache',
+                             num_workers=None,
+                             chunk_size=CHUNK_GRAPHS
+                             ):
+    """
+    Recursively runs the conjecture tests (test_conjectures_batch) on all .jsonl files found under the root directory.
+    - Handles both regular and nested subdirectories.
+    - Streams the .jsonl members of .tar.gz files without extracting them.
+    - Streams split archives like .tar.gz.part00.part, .part01.part, etc. by
+      reading the parts one after another, without joining them on disk.
+    - Reads each .jsonl through a cached columnar sidecar in sidecar_dir, built on
+      first use and rebuilt when the file changes; later runs memory-map it
+      instead of decoding JSON.
+    - Spreads archives and chunks of chunk_size graphs of each file over
+      num_workers processes. Each returns a PartialResult, merged in a fixed
+      order, so the output is the same for any number of workers.
 
-                    for batch in tqdm(stream_results_in_batches(filepath, batch_size),
-                                      total=total_lines // batch_size,
-                                      desc=f"Processing {filepath}"):
-                        for data in batch:
-                            test_conjectures(data, worst_case_approx_dict=worst_case_approx_dict, output_filename=output_filename)
+    Parameters:
+    - root: str - root directory to start searching
+    - batch_size: int - records decoded and evaluated together when a file has no
+      sidecar or comes from an archive; chunk_size is rounded up to a multiple of it
+    - output_filename: str - file to write failing conjectures to
+    - process_tarred_files: bool - whether to process tarred files (bigger files leads to heavier computation)
+    - sidecar_dir: str or None - directory for the sidecars; None decodes every file directly
+    - num_workers: int or None - worker processes (default: CPU count; 1 runs everything in this process)
+    - chunk_size: int - graphs per unit of work, rounded up to whole batches
+    """
+    worst_case_approx_dict = {key: 1 for key in WORST_CASE_KEYS}
+    num_workers = num_workers or os.cpu_count() or 1
+
+    # delete the output file if it exists
+    if os.path.exists(output_filename):
+        os.remove(output_filename)
+
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    try:
+        units = plan_units(root, batch_size, chunk_size, process_tarred_files, sidecar_dir, pool)
+        tasks = [unit for unit, _ in units if unit is not None]
+        partials = pool.imap(run_unit, tasks) if pool else map(run_unit, tasks)
 
-                except Exception as e:
-                    print(f"Error processing {filepath}: {e}")
+        # .jsonl files already tested as archive members (e.g. left over from an earlier extraction)
+        streamed_files = set()
+        stopped_files = set()
+        for unit, (kind, dirpath, path, notes) in tqdm(units, desc="Testing conjectures"):
+            partial = next(partials) if unit is not None else PartialResult()
+            if kind == 'archive':
+                partial.merge_into(worst_case_approx_dict, output_filename)
+                streamed_files.update(os.path.normpath(os.path.join(dirpath, name)) for name in partial.members)
+                continue
+            if os.path.normpath(path) in streamed_files or path in stopped_files:
+                continue
+            for note in notes:
+                print(note)
+            partial.merge_into(worst_case_approx_dict, output_filename)
+            if partial.error is not None:
+                print(partial.error)
+                stopped_files.add(path)
+    except BaseException:
+        # Ctrl-C or a failed unit: drop the queued units instead of waiting for them
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     # delete worst_case_approx.json if it exists
     if os.path.exists('worst_case_approx.json'):
         os.remove('worst_case_approx.json')
     # save worst_case_approx_dict to json
     with open('worst_case_approx.json', 'w') as f:
-        json_str = jsonpickle.encode(worst_case_approx_dict)  # Get the JSON string
+        json_str = json.dumps(worst_case_approx_dict)  # Get the JSON string
         f.write(json_str)
-    
-    # Clean up extracted files and combined tar files
-    for jsonl_path in extracted_jsonl_files:
-        if os.path.exists(jsonl_path):
-            print(f"Deleting extracted file: {jsonl_path}")
-            os.remove(jsonl_path)
-    for tar_path in combined_tar_files:
-        if os.path.exists(tar_path):
-            print(f"Deleting combined tar file: {tar_path}")
-            os.remove(tar_path)
 
 if __name__ == '__main__':
     run_all_conjecture_tests()
@@ -0,0 +1,136 @@
+"""
+Durable progress of a parallel_compute_data run, for --resume.
+
+The checkpoint is a small JSON sidecar next to the output file. It records
+which input units (graphs numbered by non-empty input line, or the byte
+ranges of --mmap mode, numbered from 0) have had their records and failures
+written, as a watermark below which every unit is done plus the runs of done
+units above it (results can complete out of order), together with the output
+and failed-graphs file sizes at that moment. It is rewritten atomically right
+after a write, at most every SAVE_INTERVAL seconds, so after a crash the
+output is truncated back to the recorded sizes and exactly the units not
+marked done are processed again: no duplicates and nothing missing. A run
+that completes deletes it.
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterable, List, Set, Union
+
+# Minimum seconds between two saves of save_if_due
+SAVE_INTERVAL = 10.0
+
+
+def input_signature(input_file: Union[str, Path]) -> dict:
+    """Size and modification time of the input, to refuse resuming on a changed file."""
+    stat = os.stat(input_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_size(path: Union[str, Path]) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def to_runs(indices: Set[int]) -> List[List[int]]:
+    """Sorted [first, last] runs of consecutive indices."""
+    runs = []
+    for index in sorted(indices):
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return runs
+
+
+def fsync_file(path: Union[str, Path]) -> None:
+    """Flush a file written through another handle to disk."""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+
+
+class Checkpoint:
+    """
+    Set of done input indices, stored as a watermark plus the done indices above
+    it (saved as runs). unit names what an index counts ("lines", or "bytes:<range size>" for
+    byte ranges) so a resumed run splits the input the same way.
+    """
+
+    def __init__(self, path: Union[str, Path], input_file: Union[str, Path], unit: str = "lines"):
+        self.path = Path(path)
+        self.signature = input_signature(input_file)
+        self.unit = unit
+        self.watermark = 0
+        self.done = set()
+        self.output_bytes = 0
+        self.failed_bytes = 0
+        self.saved_at = None
+
+    @classmethod
+    def load(cls, path: Union[str, Path], input_file: Union[str, Path]) -> "Checkpoint":
+        """
+        The checkpoint saved at path, or an empty one if there is none. Raises
+        ValueError if it was written for a different version of input_file.
+        """
+        checkpoint = cls(path, input_file)
+        if not checkpoint.path.exists():
+            return checkpoint
+        with open(checkpoint.path) as f:
+            state = json.load(f)
+        if state["input"] != checkpoint.signature:
+            raise ValueError(f"{input_file} changed since {path} was written; rerun without --resume")
+        checkpoint.unit = state["unit"]
+        checkpoint.watermark = state["watermark"]
+        checkpoint.done = {index for first, last in state["done"] for index in range(first, last + 1)}
+        checkpoint.output_bytes = state["output_bytes"]
+        checkpoint.failed_bytes = state["failed_bytes"]
+        return checkpoint
+
+    def __contains__(self, index: int) -> bool:
+        return index < self.watermark or index in self.done
+
+    def __len__(self) -> int:
+        return self.watermark + len(self.done)
+
+    def mark_done(self, indices: Iterable[int]) -> None:
+        self.done.update(indices)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+
+    def save(self, output_file: Union[str, Path], failed_file: Union[str, Path]) -> None:
+        """
+        Record the current output and failed-file sizes with the done set.
+        Both files are synced to disk first and the sidecar is replaced
+        atomically, so a checkpoint never claims more than was written.
+        """
+        fsync_file(output_file)
+        fsync_file(failed_file)
+        self.output_bytes = file_size(output_file)
+        self.failed_bytes = file_size(failed_file)
+        state = {"input": self.signature, "unit": self.unit, "watermark": self.watermark,
+                 "done": to_runs(self.done), "output_bytes": self.output_bytes, "failed_bytes": self.failed_bytes}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.saved_at = time.monotonic()
+
+    def save_if_due(self, output_file: Union[str, Path], failed_file: Union[str, Path]) -> None:
+        """save, unless the last save was less than SAVE_INTERVAL seconds ago."""
+        if self.saved_at is None or time.monotonic() - self.saved_at >= SAVE_INTERVAL:
+            self.save(output_file, failed_file)
+
+    def remove(self) -> None:
+        """Delete the checkpoint once the run it tracks has completed."""
+        self.path.unlink(missing_ok=True)
+
+    def truncate(self, output_file: Union[str, Path], failed_file: Union[str, Path]) -> None:
+        """Cut the output and failed files back to their sizes at the last save."""
+        for path, size in ((output_file, self.output_bytes), (failed_file, self.failed_bytes)):
+            if os.path.exists(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
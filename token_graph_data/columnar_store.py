@@ -0,0 +1,309 @@
+"""
+Columnar store for token-graph datasets: the *_data.jsonl records as
+fixed-width NumPy arrays that can be memory-mapped instead of parsed.
+
+A store is a directory holding manifest.json and shards part-00000/,
+part-00001/, ... of up to SHARD_ROWS graphs each. Every shard is a set of
+.npy files, one row per graph:
+
+    n             int32   (rows,)              number of vertices
+    W, C, M       float64 (rows,)              graph invariants
+    k_data        float64 (rows, max_k, 8)     per k = 1..max_k, the columns of
+                                               record_codec.K_FIELDS; NaN past n/2
+    edge_offsets  int64   (rows + 1,)          graph i owns edges[edge_offsets[i]:edge_offsets[i + 1]]
+    edges         int32   (total edges, 2)     (u, v) as positions in the graph's node list
+    weights       float64 (total edges,)
+    offsets       int64   (rows,)              byte offset of the graph's line in the source
+                                               .jsonl, or -1 if unknown
+
+The manifest is written last (atomically), so a store without one is incomplete.
+
+Stores also serve as cached sidecars of .jsonl files (open_sidecar): the
+manifest's source then records the file's path, size, mtime and SHA-256, and
+a sidecar whose source no longer matches is rebuilt.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, List, Union
+import numpy as np
+from record_codec import K_FIELDS, graph6_to_edges, loads
+
+SHARD_ROWS = 1 << 17
+MANIFEST = "manifest.json"
+STORE_FORMAT = "token-graph-columns"
+STORE_VERSION = 2
+COLUMNS = ("n", "W", "C", "M", "k_data", "edge_offsets", "edges", "weights", "offsets")
+
+
+def record_fields(record: Dict):
+    """
+    (n, [(u, v, weight)], [W, C, M], k rows in K_FIELDS order) of a decoded
+    record in either record_codec layout.
+    """
+    if "k" in record:
+        if "g6" in record:
+            n, pairs = graph6_to_edges(record["g6"])
+            edges = [(u, v, 1.0) for u, v in pairs]
+        elif "edges" in record:
+            n, edges = record["n"], record["edges"]
+        else:
+            n, edges = node_link_edges(record["graph"])
+        return n, edges, record["inv"], record["k"]
+
+    n, edges = node_link_edges(record["graph"])
+    invariants = record["graph_invariants"]
+    rows = []
+    for _, k_dict in sorted(record["k_data"].items(), key=lambda item: int(item[0])):
+        spec = k_dict["spec"]
+        rows.append([k_dict["M_le_k"], k_dict["C_k"],
+                     spec["A"]["min"], spec["A"]["max"], spec["L"]["min"], spec["L"]["max"],
+                     spec["Q"]["min"], spec["Q"]["max"]])
+    return n, edges, [invariants["W"], invariants["C"], invariants["M"]], rows
+
+
+def k_data_array(k_rows: List[List]) -> np.ndarray:
+    """(graphs, max k, len(K_FIELDS)) array of per-graph k rows, NaN past each graph's last k."""
+    max_k = max((len(rows) for rows in k_rows), default=0)
+    k_data = np.full((len(k_rows), max_k, len(K_FIELDS)), np.nan)
+    for i, rows in enumerate(k_rows):
+        if rows:
+            k_data[i, :len(rows)] = rows
+    return k_data
+
+
+def records_to_columns(records: List[Dict]) -> Dict[str, np.ndarray]:
+    """The n, W, C, M and k_data columns (no edges) of decoded records in either layout."""
+    n, invariants, k_rows = [], [], []
+    for record in records:
+        record_n, _, record_invariants, rows = record_fields(record)
+        n.append(record_n)
+        invariants.append(record_invariants)
+        k_rows.append(rows)
+    invariants = np.array(invariants, dtype=np.float64).reshape(len(records), 3)
+    return {"n": np.array(n, dtype=np.int32), "W": invariants[:, 0], "C": invariants[:, 1],
+            "M": invariants[:, 2], "k_data": k_data_array(k_rows)}
+
+
+def node_link_edges(graph: Dict):
+    """(n, [(u, v, weight)]) of a node-link dict, with vertices as positions in its node list."""
+    position = {node["id"]: i for i, node in enumerate(graph["nodes"])}
+    return len(position), [(position[e["source"]], position[e["target"]], e.get("weight", 1.0))
+                           for e in graph["edges"]]
+
+
+class ColumnarWriter:
+    """Collects records and writes them to a new store at directory, SHARD_ROWS per shard."""
+
+    def __init__(self, directory: Union[str, Path], shard_rows: int = SHARD_ROWS):
+        self.directory = Path(directory)
+        self.shard_rows = shard_rows
+        if self.directory.exists():
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True)
+        self.shards = []
+        self._clear()
+
+    def _clear(self):
+        self.n, self.invariants, self.k_rows = [], [], []
+        self.edge_counts, self.edges, self.weights = [], [], []
+        self.offsets = []
+
+    def add(self, record: Dict, offset: int = -1) -> None:
+        """Add one decoded record; offset is the byte offset of its line in the source, if known."""
+        n, edges, invariants, k_rows = record_fields(record)
+        self.n.append(n)
+        self.offsets.append(offset)
+        self.invariants.append(invariants)
+        self.k_rows.append(k_rows)
+        self.edge_counts.append(len(edges))
+        for u, v, weight in edges:
+            self.edges.append((u, v))
+            self.weights.append(weight)
+        if len(self.n) >= self.shard_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the collected rows as the next shard."""
+        rows = len(self.n)
+        if rows == 0:
+            return
+        k_data = k_data_array(self.k_rows)
+        invariants = np.array(self.invariants, dtype=np.float64).reshape(rows, 3)
+        columns = {
+            "n": np.array(self.n, dtype=np.int32),
+            "W": invariants[:, 0], "C": invariants[:, 1], "M": invariants[:, 2],
+            "k_data": k_data,
+            "edge_offsets": np.concatenate([[0], np.cumsum(self.edge_counts)]).astype(np.int64),
+            "edges": np.array(self.edges, dtype=np.int32).reshape(-1, 2),
+            "weights": np.array(self.weights, dtype=np.float64),
+            "offsets": np.array(self.offsets, dtype=np.int64),
+        }
+        name = f"part-{len(self.shards):05d}"
+        (self.directory / name).mkdir()
+        for column, array in columns.items():
+            np.save(self.directory / name / f"{column}.npy", np.ascontiguousarray(array))
+        self.shards.append({"path": name, "rows": rows, "max_k": k_data.shape[1]})
+        self._clear()
+
+    def close(self, source: Dict = None) -> None:
+        """Flush the last shard and write the manifest; source is stored in it as is."""
+        self.flush()
+        manifest = {"format": STORE_FORMAT, "version": STORE_VERSION, "k_fields": list(K_FIELDS),
+                    "rows": sum(shard["rows"] for shard in self.shards), "shards": self.shards,
+                    "source": source or {}}
+        write_manifest(self.directory, manifest)
+
+
+def jsonl_to_columnar(jsonl_path: Union[str, Path], directory: Union[str, Path],
+                      shard_rows: int = SHARD_ROWS, source: Dict = None) -> Dict:
+    """Convert a *_data.jsonl file (either record layout) into a store; returns its manifest."""
+    writer = ColumnarWriter(directory, shard_rows)
+    offset = 0
+    with open(jsonl_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                writer.add(loads(line), offset)
+            offset += len(line)
+    writer.close(source)
+    return read_manifest(directory)
+
+
+def write_manifest(directory: Union[str, Path], manifest: Dict) -> None:
+    tmp = Path(directory) / (MANIFEST + ".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, Path(directory) / MANIFEST)
+
+
+def read_manifest(directory: Union[str, Path]) -> Dict:
+    with open(Path(directory) / MANIFEST) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != STORE_FORMAT or manifest.get("version") != STORE_VERSION:
+        raise ValueError(f"{directory} is not a version {STORE_VERSION} {STORE_FORMAT} store")
+    return manifest
+
+
+class ColumnarStore:
+    """Read access to a store; every array is memory-mapped read-only."""
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+        self.manifest = read_manifest(directory)
+        self.rows = self.manifest["rows"]
+        self.max_k = max((shard["max_k"] for shard in self.manifest["shards"]), default=0)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def shard(self, i: int) -> Dict[str, np.ndarray]:
+        """The columns of shard i, memory-mapped."""
+        path = self.directory / self.manifest["shards"][i]["path"]
+        return {column: np.load(path / f"{column}.npy", mmap_mode='r') for column in COLUMNS}
+
+    def shards(self) -> Iterator[Dict[str, np.ndarray]]:
+        for i in range(len(self.manifest["shards"])):
+            yield self.shard(i)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        One per-graph column over the whole store (n, W, C, M, offsets or k_data, the
+        latter padded with NaN to max_k). Zero-copy for single-shard stores.
+        """
+        parts = []
+        for shard in self.shards():
+            part = shard[name]
+            if name == "k_data" and part.shape[1] < self.max_k:
+                part = np.pad(part, ((0, 0), (0, self.max_k - part.shape[1]), (0, 0)), constant_values=np.nan)
+            parts.append(part)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.zeros(0)
+
+    def k_column(self, field: str) -> np.ndarray:
+        """(rows, max_k) array of one K_FIELDS column, e.g. "L_max"."""
+        return self.column("k_data")[:, :, K_FIELDS.index(field)]
+
+    def graph_edges(self, i: int) -> List:
+        """[(u, v, weight)] of graph i."""
+        for shard_info, shard in zip(self.manifest["shards"], self.shards()):
+            if i < shard_info["rows"]:
+                start, end = shard["edge_offsets"][i], shard["edge_offsets"][i + 1]
+                return [(int(u), int(v), float(w)) for (u, v), w in zip(shard["edges"][start:end],
+                                                                        shard["weights"][start:end])]
+            i -= shard_info["rows"]
+        raise IndexError("graph index out of range")
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sidecar_path(jsonl_path: Union[str, Path], cache_dir: Union[str, Path]) -> Path:
+    """Sidecar store of a .jsonl file in cache_dir, named after the file and its absolute path."""
+    jsonl_path = Path(jsonl_path).resolve()
+    key = hashlib.sha256(str(jsonl_path).encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{jsonl_path.stem}-{key}.columns"
+
+
+def open_sidecar(jsonl_path: Union[str, Path], cache_dir: Union[str, Path]) -> ColumnarStore:
+    """
+    The sidecar store of a .jsonl file, built on first use and rebuilt when
+    stale. A sidecar is current if it was built from the same path and size
+    and either the same mtime or, failing that, the same SHA-256 (a file that
+    was only touched or re-extracted keeps its sidecar). Raises whatever
+    decoding the file raises if it has to be built and a line is malformed.
+    """
+    path = str(Path(jsonl_path).resolve())
+    stat = os.stat(path)
+    directory = sidecar_path(path, cache_dir)
+    try:
+        store = ColumnarStore(directory)
+    except (OSError, ValueError, KeyError):
+        store = None
+    digest = None
+    if store is not None:
+        cached = store.manifest["source"]
+        if cached.get("path") == path and cached.get("size") == stat.st_size:
+            if cached.get("mtime_ns") == stat.st_mtime_ns:
+                return store
+            digest = file_digest(path)
+            if cached.get("sha256") == digest:
+                store.manifest["source"]["mtime_ns"] = stat.st_mtime_ns
+                write_manifest(directory, store.manifest)
+                return store
+    source = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+              "sha256": digest or file_digest(path)}
+    jsonl_to_columnar(path, directory, source=source)
+    return ColumnarStore(directory)
+
+
+def columnar_cli():
+    """Command-line interface: convert *_data.jsonl files into columnar stores."""
+    parser = argparse.ArgumentParser(description='Convert *_data.jsonl files into columnar stores')
+    parser.add_argument('jsonl_files', nargs='+', help='Data files written by parallel_compute_data')
+    parser.add_argument('--shard_rows', type=int, default=SHARD_ROWS,
+                        help=f'Graphs per shard (default: {SHARD_ROWS})')
+    args = parser.parse_args()
+    for path in args.jsonl_files:
+        directory = columnar_path(path)
+        manifest = jsonl_to_columnar(path, directory, args.shard_rows)
+        print(f"{path}: {manifest['rows']} graphs in {len(manifest['shards'])} shards at {directory}")
+
+
+def columnar_path(jsonl_path: Union[str, Path]) -> Path:
+    """Store directory next to a data file: <stem>.columns."""
+    jsonl_path = Path(jsonl_path)
+    return jsonl_path.with_name(jsonl_path.stem + ".columns")
+
+
+if __name__ == "__main__":
+    columnar_cli()
@@ -9,12 +9,14 @@ SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 REPO_ROOT="$(dirname "$SCRIPT_DIR")"
 # Python script path
 PY_SCRIPT="$SCRIPT_DIR/parallel_compute_data.py"
+# Fitted cost models, one per graph type (kept out of data/)
+COST_MODEL_DIR="$SCRIPT_DIR/cost_models"
 
 for TYPE in weighted unweighted; do
   INPUT_DIR="$REPO_ROOT/graph_generation/graphs/$TYPE"
   OUTPUT_DIR="$SCRIPT_DIR/data/$TYPE"
 
-  mkdir -p "$OUTPUT_DIR"
+  mkdir -p "$OUTPUT_DIR" "$COST_MODEL_DIR"
 
   for graph_file in "$INPUT_DIR"/*; do
     [ -f "$graph_file" ] || continue  # Skip non-files safely
@@ -23,7 +25,11 @@ for TYPE in weighted unweighted; do
       "$graph_file" \
       --output_dir "$OUTPUT_DIR" \
       --workers "$WORKERS" \
-      --batch_size "$BATCH_SIZE"
+      --batch_size "$BATCH_SIZE" \
+      --share_templates \
+      --schedule lpt \
+      --split_min_dim 1000 \
+      --cost_model "$COST_MODEL_DIR/$TYPE.json"
   done
 done
 
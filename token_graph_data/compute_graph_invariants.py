@@ -1,14 +1,31 @@
 import networkx as nx
+from functools import lru_cache
 from itertools import combinations
 import numpy as np
 
+# Slack for deciding that a penalised matching beats a chord in matching_profile.
+MATCHING_PROFILE_TOL = 1e-9
+# Largest order for which cut profiles use the (2^n x n) bit-matrix kernel;
+# above it get_cut_profile falls back to the O(n)-memory Gray-code walk.
+VECTORIZED_CUT_MAX_N = 16
+# Upper bound on the bytes of the (2^n, B, n) intermediate of batched_cut_profiles.
+CUT_BATCH_MAX_BYTES = 1 << 26
+
+
+def has_unit_weights(G):
+    """True if every edge of G has weight 1 (edges without a weight count as 1)."""
+    return all(d.get('weight', 1) == 1 for _, _, d in G.edges(data=True))
+
 
 def get_weight_sum(G):
     return G.size(weight="weight")
 
 
-def get_maximum_matching(G, return_edges=False):
-    M_list = nx.max_weight_matching(G, weight='weight')
+def get_maximum_matching(G, return_edges=False, context=None):
+    if context is not None:
+        M_list = context.max_weight_matching
+    else:
+        M_list = nx.max_weight_matching(G, weight='weight')
     if return_edges: return sum([G[u][v]['weight'] for u,v in M_list]), M_list
     else: return sum([G[u][v]['weight'] for u,v in M_list])
 
@@ -47,13 +64,19 @@ import networkx as nx
 import numpy as np
 
 def max_weight_matching_at_most_k(G: nx.Graph, k: int,
-                                  return_edges: bool = False):
-    """Exact max-weight matching using ≤k edges via branch-and-bound."""
-    edges_sorted: List[Tuple[int,int]] = sorted(
-        G.edges(), key=lambda e: G[e[0]][e[1]].get("weight", 1.0), reverse=True)
+                                  return_edges: bool = False, context=None):
+    """
+    Exact max-weight matching using ≤k edges via branch-and-bound.
+    The sorted edges and their prefix sums come from context if given.
+    """
+    if context is not None:
+        edges_sorted, prefix_sums = context.edges_by_weight, context.weight_prefix_sums
+    else:
+        edges_sorted: List[Tuple[int,int]] = sorted(
+            G.edges(), key=lambda e: G[e[0]][e[1]].get("weight", 1.0), reverse=True)
+        prefix_sums = np.cumsum([G[u][v].get("weight", 1.0) for u, v in edges_sorted])
 
     best_w, best_set = -np.inf, set()
-    prefix_sums = np.cumsum([G[u][v].get("weight", 1.0) for u, v in edges_sorted])
 
     def dfs(idx: int, chosen: Set[Tuple[int,int]], used: Set[int], cur_w: float):
         nonlocal best_w, best_set
@@ -80,17 +103,86 @@ def max_weight_matching_at_most_k(G: nx.Graph, k: int,
     dfs(0, set(), set(), 0.0)
     return (best_w, best_set) if return_edges else best_w
 
-def get_maximum_matching_at_most_k_edges(G, k, return_edges=False):
+def get_maximum_matching_at_most_k_edges(G, k, return_edges=False, context=None):
     """
     Exact solution but orders-of-magnitude faster than the old brute force.
     Falls back to the trivial case if the unrestricted matching
     already has ≤k edges.
     """
-    total, full = get_maximum_matching(G, return_edges=True)
+    total, full = get_maximum_matching(G, return_edges=True, context=context)
     if len(full) <= k:
         return (total, full) if return_edges else total
     # otherwise use branch-and-bound
-    return max_weight_matching_at_most_k(G, k, return_edges)
+    return max_weight_matching_at_most_k(G, k, return_edges, context)
+
+
+def get_penalized_matching(G, penalty):
+    """
+    Max-weight matching of G with every edge weight lowered by penalty.
+    Returns its (original) weight and its number of edges.
+    """
+    H = nx.Graph()
+    H.add_weighted_edges_from((u, v, d.get("weight", 1) - penalty)
+                              for u, v, d in G.edges(data=True) if u != v and d.get("weight", 1) > penalty)
+    matching = nx.max_weight_matching(H, weight='weight')
+    return sum(G[u][v].get("weight", 1) for u, v in matching), len(matching)
+
+
+def matching_profile(G, max_k=None, context=None):
+    """
+    M_le_k for every k = 0..max_k (default n // 2) from a few blossom runs.
+
+    The best weight f(j) of a matching with exactly j edges is concave in j up
+    to the size j* of the max-weight matching, so M_le_k = f(min(k, j*)) and f
+    is fixed by its breakpoints. Starting from (0, 0) and (j*, M), the chord
+    between two known points is tested with a penalty equal to its slope: the
+    penalised optimum either lies above the chord, giving a new point of
+    intermediate size, or f is linear between the two points.
+    The max-weight matching is taken from context if given.
+    """
+    if max_k is None:
+        max_k = G.number_of_nodes() // 2
+    if context.unit_weights if context is not None else has_unit_weights(G):
+        return unit_weight_matching_profile(G, max_k, context)
+    total, full = get_maximum_matching(G, return_edges=True, context=context)
+    points = {0: 0, len(full): total}
+    segments = [(0, len(full))]
+    while segments:
+        a, b = segments.pop()
+        if b - a < 2:
+            continue
+        slope = (points[b] - points[a]) / (b - a)
+        value, size = get_penalized_matching(G, slope)
+        chord = points[a] + slope * (size - a)
+        if a < size < b and value > chord + MATCHING_PROFILE_TOL * max(1, abs(chord)):
+            points[size] = value
+            segments += [(a, size), (size, b)]
+
+    sizes = sorted(points)
+    profile = []
+    for k in range(max_k + 1):
+        j = min(k, sizes[-1])
+        right = next(s for s in sizes if s >= j)
+        if right == j:
+            profile.append(points[j])
+        else:
+            left = max(s for s in sizes if s < j)
+            slope = (points[right] - points[left]) / (right - left)
+            profile.append(points[left] + slope * (j - left))
+    return profile
+
+
+def unit_weight_matching_profile(G, max_k, context=None):
+    """
+    matching_profile for unit weights: with matching number nu, any nu edges of
+    a maximum matching are the best choice, so M_le_k = min(k, nu). With unit
+    weights the max-weight matching of context is a maximum matching.
+    """
+    if context is not None:
+        nu = len(context.max_weight_matching)
+    else:
+        nu = len(nx.max_weight_matching(G, maxcardinality=True))
+    return [float(min(k, nu)) for k in range(max_k + 1)]
 
 
 def calculate_cut_value(G, partition):
@@ -102,17 +194,166 @@ def calculate_cut_value(G, partition):
     return cut_value
 
 
-def get_maximum_cut(G, return_partitions=False):
+def gray_code_cut_profile(G):
+    """
+    Bitmask (over G.nodes order) of a maximum cut for every side size s = 0..n,
+    in one pass over the 2^(n-1) bipartitions (last vertex kept outside S).
+    They are visited in Gray-code order, so each step flips one vertex and
+    updates the cut in O(deg).
+    """
+    nodes = list(G.nodes)
+    n = len(nodes)
+    position = {v: i for i, v in enumerate(nodes)}
+    neighbours = [[] for _ in range(n)]
+    for u, v, data in G.edges(data=True):
+        if u != v:
+            w = data.get('weight', 1)
+            neighbours[position[u]].append((position[v], w))
+            neighbours[position[v]].append((position[u], w))
+
+    inside = [False] * n
+    mask, size, cut = 0, 0, 0
+    full = (1 << n) - 1
+    best = [-np.inf] * (n + 1)
+    best_mask = [0] * (n + 1)
+    best[0], best[n], best_mask[n] = 0, 0, full
+    for step in range(1, 2 ** (n - 1)):
+        i = (step & -step).bit_length() - 1
+        # edges to the same side become cut, edges to the other side stop being cut
+        cut += sum(w if inside[j] == inside[i] else -w for j, w in neighbours[i])
+        inside[i] = not inside[i]
+        mask ^= 1 << i
+        size += 1 if inside[i] else -1
+        if cut > best[size]:
+            best[size], best_mask[size] = cut, mask
+        if cut > best[n - size]:
+            best[n - size], best_mask[n - size] = cut, full ^ mask
+
+    return best_mask
+
+
+@lru_cache(maxsize=None)
+def subset_bit_matrix(n):
+    """
+    (2^n, n) 0/1 matrix whose row m holds the bits of m, and for every side
+    size s = 0..n the rows with popcount s.
+    """
+    X = ((np.arange(2 ** n)[:, None] >> np.arange(n)) & 1).astype(float)
+    X.setflags(write=False)
+    sizes = X.sum(axis=1).astype(int)
+    return X, [np.flatnonzero(sizes == s) for s in range(n + 1)]
+
+
+def get_weight_matrix(G):
+    """Dense weighted adjacency matrix of G in G.nodes order (weight 1 if missing)."""
+    return nx.to_numpy_array(G, weight='weight')
+
+
+def batched_cut_profiles(W):
+    """
+    Maximum cut per side size for a stack of weighted adjacency matrices W of
+    shape (B, n, n), or a single (n, n) matrix.
+
+    The cut of every subset x is x^T W (1 - x); all 2^n subsets of all graphs in
+    a chunk come out of one (2^n, n) @ (n, B*n) product, then a popcount
+    group-by takes the maximum per side size.
+
+    Returns
+    -------
+    (best, best_masks) : two (B, n + 1) arrays, the maximum cut values and the
+    bitmasks of partitions attaining them.
+    """
+    W = np.asarray(W, dtype=float)
+    if W.ndim == 2:
+        W = W[None]
+    B, n, _ = W.shape
+    X, by_size = subset_bit_matrix(n)
+    best = np.empty((B, n + 1))
+    best_masks = np.empty((B, n + 1), dtype=np.int64)
+    chunk_size = max(1, CUT_BATCH_MAX_BYTES // (8 * 2 ** n * max(n, 1)))
+    for start in range(0, B, chunk_size):
+        W_chunk = W[start:start + chunk_size]
+        b = len(W_chunk)
+        XW = (X @ W_chunk.transpose(1, 0, 2).reshape(n, b * n)).reshape(-1, b, n)
+        cuts = np.einsum('mbj,mj->bm', XW, 1 - X)
+        rows = np.arange(b)
+        for size, members in enumerate(by_size):
+            winners = members[cuts[:, members].argmax(axis=1)]
+            best_masks[start:start + b, size] = winners
+            best[start:start + b, size] = cuts[rows, winners]
+    return best, best_masks
+
+
+def score_cut_profile(G, best_masks):
+    """Exact cut values (calculate_cut_value) of the partitions in best_masks."""
+    nodes = list(G.nodes)
+    return [calculate_cut_value(G, {nodes[i] for i in range(len(nodes)) if m >> i & 1}) for m in best_masks]
+
+
+def unit_weight_cut_profile(G):
+    """
+    get_cut_profile for unit weights with integer arithmetic only: the cut size
+    of every subset mask is the popcount of (mask >> u) ^ (mask >> v) summed
+    over the edges (u, v), maximised per side size.
+    """
+    nodes = list(G.nodes)
+    n = len(nodes)
+    position = {v: i for i, v in enumerate(nodes)}
+    masks = np.arange(2 ** n)
+    cuts = np.zeros(2 ** n, dtype=np.int32)
+    for u, v in G.edges():
+        if u != v:
+            cuts += ((masks >> position[u]) ^ (masks >> position[v])) & 1
+    _, by_size = subset_bit_matrix(n)
+    return [float(cuts[members].max()) for members in by_size]
+
+
+def get_cut_profile(G, context=None):
+    """
+    Maximum cut for every side size: best[s] is the largest cut value over all
+    S with |S| = s, for s = 0..n.
+
+    Uses the batched_cut_profiles kernel up to VECTORIZED_CUT_MAX_N vertices and
+    gray_code_cut_profile above. Either way the winning partition of each size
+    is re-scored with calculate_cut_value, so the values match a plain
+    enumeration exactly and carry no rounding from the fast kernels. Unit-weight
+    graphs take the integer unit_weight_cut_profile kernel instead.
+    """
+    unit = context.unit_weights if context is not None else has_unit_weights(G)
+    if G.number_of_nodes() <= VECTORIZED_CUT_MAX_N and unit:
+        return unit_weight_cut_profile(G)
+    if G.number_of_nodes() <= VECTORIZED_CUT_MAX_N:
+        _, best_masks = batched_cut_profiles(get_weight_matrix(G))
+        return score_cut_profile(G, (int(m) for m in best_masks[0]))
+    return score_cut_profile(G, gray_code_cut_profile(G))
+
+
+def get_cut_profiles(graphs):
+    """
+    get_cut_profile for many graphs: weighted graphs of the same order up to
+    VECTORIZED_CUT_MAX_N share batched_cut_profiles calls.
+    """
+    profiles = [None] * len(graphs)
+    by_order = {}
+    for i, G in enumerate(graphs):
+        if G.number_of_nodes() <= VECTORIZED_CUT_MAX_N and not has_unit_weights(G):
+            by_order.setdefault(G.number_of_nodes(), []).append(i)
+        else:
+            profiles[i] = get_cut_profile(G)
+    for indices in by_order.values():
+        _, best_masks = batched_cut_profiles(np.stack([get_weight_matrix(graphs[i]) for i in indices]))
+        for i, masks in zip(indices, best_masks):
+            profiles[i] = score_cut_profile(graphs[i], (int(m) for m in masks))
+    return profiles
+
+
+def get_maximum_cut(G, return_partitions=False, cut_profile=None, context=None):
     nodes = G.nodes
     n = len(nodes)
+    if cut_profile is None:
+        cut_profile = context.cut_profile if context is not None else get_cut_profile(G)
     weights = range(1, n // 2 + 1)
-    max_cut_at_weight = {weight: 0 for weight in weights}
-    # Iterate over all possible partitions
-    for weight in weights:
-        for subset in combinations(nodes, weight):
-            cut_value = calculate_cut_value(G, set(subset))
-            if cut_value > max_cut_at_weight[weight]:
-                max_cut_at_weight[weight] = cut_value
+    max_cut_at_weight = {weight: max(0, cut_profile[weight]) for weight in weights}
     max_cut = max(max_cut_at_weight.values())
     if return_partitions:
         return max_cut, [k for k,v in max_cut_at_weight.items() if np.abs(v-max_cut)<TOL]
@@ -120,13 +361,7 @@ def get_maximum_cut(G, return_partitions=False):
         return max_cut
     
     
-def get_maximum_k_cut(G, k):
-    nodes = G.nodes
-    n = len(nodes)
-    max_cut = -np.inf
-    # Iterate over all possible partitions
-    for subset in combinations(nodes, k):
-        cut_value = calculate_cut_value(G, set(subset))
-        if cut_value > max_cut: 
-            max_cut  = cut_value
-    return max_cut
\ No newline at end of file
+def get_maximum_k_cut(G, k, cut_profile=None, context=None):
+    if cut_profile is None:
+        cut_profile = context.cut_profile if context is not None else get_cut_profile(G)
+    return cut_profile[k]
@@ -1,36 +1,315 @@
 from itertools import combinations
+from math import comb
 import networkx as nx
 import numpy as np
-from scipy.sparse import diags 
-from scipy.sparse.linalg import eigsh
+from scipy.sparse import csr_array, diags, diags_array
+from scipy.sparse.linalg import LinearOperator, eigsh
 
 def get_token_graph(G, k):
+    """
+    Build the k-token graph of G by swapping one token along each edge of G.
+
+    For every k-subset S and every edge (u, v) of G with u in S and v not in S,
+    S - {u} + {v} is a neighbour of S with the weight of (u, v). Each token edge
+    is emitted once, from the endpoint holding the earlier of u, v in G.nodes
+    order, so the cost is O(C(n, k) * |E|) rather than O(C(n, k)^2).
+    """
     vertices = list(G.nodes)
+    position = {v: i for i, v in enumerate(vertices)}
     Gk = nx.Graph()
     token_nodes = list(combinations(vertices, k))
     Gk.add_nodes_from(token_nodes)
-    for subset_1, subset_2 in combinations(token_nodes, 2):
-        diff_1 = set(subset_1) - set(subset_2)
-        diff_2 = set(subset_2) - set(subset_1)
-        if len(diff_1) == 1 and len(diff_2) == 1:
-            u, = diff_1
-            v, = diff_2
-            if G.has_edge(u, v):
-                weight = G.get_edge_data(u, v, default={}).get('weight', 1)
-                Gk.add_edge(subset_1, subset_2, weight=weight)
+    for subset in token_nodes:
+        members = set(subset)
+        for u in subset:
+            for v, data in G[u].items():
+                if v in members or position[v] < position[u]:
+                    continue
+                swapped = tuple(sorted((members - {u}) | {v}, key=position.__getitem__))
+                Gk.add_edge(subset, swapped, weight=data.get('weight', 1))
     return Gk
 
 def get_graph_matrices(G, nodelist=None):
     A = nx.adjacency_matrix(G, nodelist=nodelist)
-    degrees = np.array([G.degree(n) for n in (nodelist or G.nodes())])
+    degrees = np.array([G.degree(n, weight='weight') for n in (nodelist or G.nodes())])
     D = diags(degrees)
     L = D - A
     Q = D + A
     return A, L, Q
 
-def get_maximum_eigval(H):
-    return eigsh(H, k=1,  return_eigenvectors=False, which="LA")
+def subset_masks(n, k):
+    """All k-subsets of range(n) as bitmasks, in colex (ascending integer) order."""
+    masks = np.array([sum(1 << i for i in c) for c in combinations(range(n), k)], dtype=np.int64)
+    return np.sort(masks)
+
+
+def colex_rank(masks, n, k):
+    """
+    Rank k-subset bitmasks in colex order via the combinatorial number system:
+    {c_1 < ... < c_k} -> sum_i C(c_i, i).
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    binom = np.array([[comb(pos, i) for i in range(k + 1)] for pos in range(n)], dtype=np.int64)
+    ranks = np.zeros(masks.shape, dtype=np.int64)
+    seen = np.zeros(masks.shape, dtype=np.int64)
+    for pos in range(n):
+        bit = (masks >> pos) & 1
+        seen += bit
+        ranks += bit * binom[pos, seen]
+    return ranks
+
+
+def get_edge_arrays(G):
+    """Edges of G as (u, v, weight) NumPy arrays, with u, v positions in G.nodes order."""
+    position = {v: i for i, v in enumerate(G.nodes)}
+    edges = [(position[u], position[v], d.get('weight', 1)) for u, v, d in G.edges(data=True) if u != v]
+    if not edges:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    u, v, w = zip(*edges)
+    return np.array(u, dtype=np.int64), np.array(v, dtype=np.int64), np.array(w, dtype=float)
+
+
+def token_swaps(masks, n, k, u, v):
+    """
+    Token moves across the edge (u, v): indices of the subsets in masks holding a
+    token on u but not on v, and the colex ranks of the subsets they move to.
+    """
+    bit_u, bit_v = np.int64(1) << u, np.int64(1) << v
+    src = np.flatnonzero(((masks & bit_u) != 0) & ((masks & bit_v) == 0))
+    dst = colex_rank(masks[src] ^ (bit_u | bit_v), n, k)
+    return src, dst
+
+
+def pair_rank(u, v, n):
+    """Rank of the vertex pair {u, v} in combinations(range(n), 2) order."""
+    lo, hi = np.minimum(u, v), np.maximum(u, v)
+    return lo * n - lo * (lo + 1) // 2 + (hi - lo - 1)
+
+
+def get_pair_weights(G):
+    """Edge weights of G scattered onto all C(n, 2) vertex pairs, zero for non-edges."""
+    n = G.number_of_nodes()
+    eu, ev, ew = get_edge_arrays(G)
+    weights = np.zeros(comb(n, 2))
+    weights[pair_rank(eu, ev, n)] = ew
+    return weights
+
+
+# (n, k) -> token_graph_template arrays. Filled lazily, or up front with views
+# into shared memory by shared_templates.attach_token_graph_templates.
+TOKEN_GRAPH_TEMPLATES = {}
+
+
+def token_graph_template(n, k):
+    """Cached build_token_graph_template(n, k); built at most once per process."""
+    if (n, k) not in TOKEN_GRAPH_TEMPLATES:
+        TOKEN_GRAPH_TEMPLATES[(n, k)] = build_token_graph_template(n, k)
+    return TOKEN_GRAPH_TEMPLATES[(n, k)]
+
+
+def build_token_graph_template(n, k):
+    """
+    Index arrays shared by every k-token graph on n vertices: the CSR structure
+    (indptr, indices) of the Johnson graph J(n, k) = k-token graph of K_n, the
+    row of every stored entry, and the pair_rank of the vertex pair {u, v} whose
+    weight the entry carries. Rows are colex ranks.
+    """
+    masks = subset_masks(n, k)
+    rows, cols, pair_ids = [], [], []
+    for p, (u, v) in enumerate(combinations(range(n), 2)):
+        src, dst = token_swaps(masks, n, k, u, v)
+        rows += [src, dst]
+        cols += [dst, src]
+        pair_ids.append(np.full(2 * len(src), p))
+    rows, cols, pair_ids = np.concatenate(rows), np.concatenate(cols), np.concatenate(pair_ids)
+    order = np.lexsort((cols, rows))
+    rows, indices, pair_ids = rows[order], cols[order], pair_ids[order]
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(masks)))))
+    for array in (indptr, indices, rows, pair_ids):
+        array.setflags(write=False)
+    return indptr, indices, rows, pair_ids
+
+
+def is_unit_weighted(pair_weights):
+    """True if get_pair_weights output only holds 0 (non-edge) and 1."""
+    return bool(np.all((pair_weights == 0) | (pair_weights == 1)))
+
+
+def get_token_graph_matrices(G, k, context=None):
+    """
+    Assemble A, L and Q of the k-token graph of G as CSR arrays without building
+    the token graph itself: G's pair weights are gathered onto the cached
+    token_graph_template(n, k). Rows are k-subsets ranked in colex order; L and Q
+    use weighted degrees. Same spectra as get_graph_matrices(get_token_graph(G, k)).
+    Unit-weight graphs get int8 A and int16 L, Q (degrees are at most k(n - k)).
+    The pair weights are taken from context if given.
+    """
+    n = G.number_of_nodes()
+    indptr, indices, rows, pair_ids = token_graph_template(n, k)
+    N = len(indptr) - 1
+    pair_weights = context.pair_weights if context is not None else get_pair_weights(G)
+    unit = is_unit_weighted(pair_weights)
+    data = pair_weights[pair_ids].astype(np.int8 if unit else float)
+    A = csr_array((data, indices, indptr), shape=(N, N), copy=True)
+    A.eliminate_zeros()  # non-edges of G
+    degrees = A.sum(axis=1).astype(np.int16 if unit else float)
+    D = diags_array(degrees, format="csr", dtype=degrees.dtype)
+    L = (D - A).tocsr()
+    Q = (D + A).tocsr()
+    return A, L, Q
+
+
+def get_dense_token_graph_matrices(pair_weights, n, k):
+    """
+    Dense A, L and Q for a stack of graphs on n vertices given as a (B, C(n, 2))
+    array of get_pair_weights rows: one scatter onto token_graph_template(n, k).
+    Returns three (B, C(n, k), C(n, k)) arrays, int16 if every graph has unit
+    weights and float otherwise.
+    """
+    indptr, indices, rows, pair_ids = token_graph_template(n, k)
+    N = len(indptr) - 1
+    B = len(pair_weights)
+    A = np.zeros((B, N, N), dtype=np.int16 if is_unit_weighted(pair_weights) else float)
+    A[:, rows, indices] = pair_weights[:, pair_ids]
+    degrees = A.sum(axis=2, dtype=A.dtype)
+    L, Q = -A, A.copy()
+    diagonal = np.arange(N)
+    L[:, diagonal, diagonal] += degrees
+    Q[:, diagonal, diagonal] += degrees
+    return A, L, Q
+
+
+def get_token_graph_operators(G, k, context=None):
+    """
+    Matrix-free A, L and Q of the k-token graph of G as LinearOperators, in the
+    same colex order as get_token_graph_matrices. Only the subset masks and the
+    weighted degrees are stored; every product re-derives the token swaps along
+    the edges of G, trading time for O(C(n, k)) memory. The edge arrays are
+    taken from context if given.
+    """
+    n = G.number_of_nodes()
+    masks = subset_masks(n, k)
+    eu, ev, ew = context.edge_arrays if context is not None else get_edge_arrays(G)
+    N = len(masks)
+    degrees = np.zeros(N)
+    for u, v, w in zip(eu, ev, ew):
+        inside_u = (masks & (np.int64(1) << u)) != 0
+        inside_v = (masks & (np.int64(1) << v)) != 0
+        degrees += w * (inside_u != inside_v)
+
+    def adjacency_matvec(x):
+        x = np.ravel(x)
+        y = np.zeros(N)
+        for u, v, w in zip(eu, ev, ew):
+            src, dst = token_swaps(masks, n, k, u, v)
+            y[src] += w * x[dst]
+            y[dst] += w * x[src]
+        return y
+
+    def laplacian_matvec(x):
+        return degrees * np.ravel(x) - adjacency_matvec(x)
+
+    def signless_laplacian_matvec(x):
+        return degrees * np.ravel(x) + adjacency_matvec(x)
+
+    A = LinearOperator((N, N), matvec=adjacency_matvec, rmatvec=adjacency_matvec, dtype=float)
+    L = LinearOperator((N, N), matvec=laplacian_matvec, rmatvec=laplacian_matvec, dtype=float)
+    Q = LinearOperator((N, N), matvec=signless_laplacian_matvec, rmatvec=signless_laplacian_matvec, dtype=float)
+    return A, L, Q
+
+
+# Solver crossover points in token-graph dimension C(n, k). One dense eigvalsh
+# per matrix beats two ARPACK runs up to a few hundred rows; past
+# MATRIX_FREE_MIN_DIM even the CSR matrices get too large for many workers.
+DENSE_MAX_DIM = 300
+MATRIX_FREE_MIN_DIM = 50000
+# Upper bound on the bytes of one stack of dense token-graph matrices.
+STACK_MAX_BYTES = 1 << 26
+# Retry settings for a token graph whose solve failed or ran out of time:
+# dense eigvalsh up to a much larger dimension (no convergence to fail) and a
+# looser ARPACK tolerance beyond it.
+FALLBACK_DENSE_MAX_DIM = 3000
+FALLBACK_TOL = 1e-6
+
+
+def select_solver(dim, dense_max_dim=DENSE_MAX_DIM, matrix_free_min_dim=MATRIX_FREE_MIN_DIM):
+    """Pick "dense", "csr" (sparse Lanczos) or "linear_operator" (matrix-free) by dimension."""
+    if dim <= dense_max_dim:
+        return "dense"
+    if dim >= matrix_free_min_dim:
+        return "linear_operator"
+    return "csr"
+
+
+def get_extreme_eigvals(H, tol=0):
+    """
+    (min, max) eigenvalue of a symmetric dense array, sparse array or
+    LinearOperator. tol is the ARPACK tolerance (0: machine precision).
+    """
+    if isinstance(H, np.ndarray):
+        eigvals = np.linalg.eigvalsh(H)
+        return eigvals[0], eigvals[-1]
+    return get_minimum_eigval(H, tol)[0], get_maximum_eigval(H, tol)[0]
+
+
+def token_graph_extreme_eigvals(G, k, backend="auto", dense_max_dim=DENSE_MAX_DIM,
+                                matrix_free_min_dim=MATRIX_FREE_MIN_DIM, context=None, tol=0):
+    """
+    (min, max) eigenvalues of A, L and Q of the k-token graph of G.
+
+    backend is "dense", "csr", "linear_operator", "networkx" (reference), or
+    "auto" to choose among the first three with select_solver. Returns
+    ({"A": (min, max), "L": ..., "Q": ...}, backend actually used). context
+    (a GraphContext of G) is passed on to the matrix builders and tol to the
+    sparse eigensolver.
+    """
+    if backend == "auto":
+        backend = select_solver(comb(G.number_of_nodes(), k), dense_max_dim, matrix_free_min_dim)
+    if backend == "dense":
+        n = G.number_of_nodes()
+        pair_weights = context.pair_weights if context is not None else get_pair_weights(G)
+        matrices = [M[0] for M in get_dense_token_graph_matrices(pair_weights[None], n, k)]
+    elif backend == "csr":
+        matrices = get_token_graph_matrices(G, k, context)
+    elif backend == "linear_operator":
+        matrices = get_token_graph_operators(G, k, context)
+    elif backend == "networkx":
+        matrices = get_graph_matrices(get_token_graph(G, k))
+    else:
+        raise ValueError(f"Unknown backend '{backend}'")
+    return dict(zip("ALQ", (get_extreme_eigvals(M, tol) for M in matrices))), backend
+
+
+def stacked_token_graph_extreme_eigvals(graphs, k, max_bytes=STACK_MAX_BYTES, contexts=None):
+    """
+    token_graph_extreme_eigvals(G, k, "dense") for many graphs of the same order.
+    A, L and Q are stacked into 3-D arrays and solved with one vectorized
+    eigvalsh per matrix type for every chunk of at most max_bytes per stack.
+    Returns one {"A": (min, max), "L": ..., "Q": ...} per graph, in order.
+    contexts, if given, holds one GraphContext per graph.
+    """
+    if not graphs:
+        return []
+    n = graphs[0].number_of_nodes()
+    dim = comb(n, k)
+    chunk_size = max(1, max_bytes // (8 * dim * dim))
+    extremes = []
+    for start in range(0, len(graphs), chunk_size):
+        if contexts is not None:
+            pair_weights = np.stack([c.pair_weights for c in contexts[start:start + chunk_size]])
+        else:
+            pair_weights = np.stack([get_pair_weights(G) for G in graphs[start:start + chunk_size]])
+        per_type = []
+        for stack in get_dense_token_graph_matrices(pair_weights, n, k):
+            eigvals = np.linalg.eigvalsh(stack)
+            per_type.append(zip(eigvals[:, 0], eigvals[:, -1]))
+        extremes += [dict(zip("ALQ", triple)) for triple in zip(*per_type)]
+    return extremes
+
+
+def get_maximum_eigval(H, tol=0):
+    return eigsh(H, k=1,  return_eigenvectors=False, which="LA", tol=tol)
 
-def get_minimum_eigval(H):
-    return eigsh(H, k=1,  return_eigenvectors=False, which="SA")
+def get_minimum_eigval(H, tol=0):
+    return eigsh(H, k=1,  return_eigenvectors=False, which="SA", tol=tol)
 
@@ -0,0 +1,58 @@
+"""
+GraphContext: per-graph cache of the intermediates that compute_graph_invariants
+and compute_token_graph_spectra would otherwise recompute for every k.
+"""
+from functools import cached_property
+import networkx as nx
+import numpy as np
+from compute_graph_invariants import get_cut_profile, has_unit_weights, matching_profile
+from compute_token_graph_spectra import get_edge_arrays, get_pair_weights
+
+
+class GraphContext:
+    """
+    Lazily computed, memoized intermediates of one graph G. Each attribute is
+    computed on first access and kept for the life of the context, so create
+    one per graph after its edge weights are final and pass it as context= to
+    the invariant and spectrum functions. An attribute can also be assigned up
+    front, e.g. a cut_profile from the batched kernel.
+    """
+
+    def __init__(self, G: nx.Graph):
+        self.G = G
+
+    @cached_property
+    def unit_weights(self) -> bool:
+        return has_unit_weights(self.G)
+
+    @cached_property
+    def max_weight_matching(self) -> set:
+        return nx.max_weight_matching(self.G, weight='weight')
+
+    @cached_property
+    def edges_by_weight(self) -> list:
+        """Edges sorted by decreasing weight."""
+        G = self.G
+        return sorted(G.edges(), key=lambda e: G[e[0]][e[1]].get("weight", 1.0), reverse=True)
+
+    @cached_property
+    def weight_prefix_sums(self) -> np.ndarray:
+        """Cumulative weights along edges_by_weight."""
+        G = self.G
+        return np.cumsum([G[u][v].get("weight", 1.0) for u, v in self.edges_by_weight])
+
+    @cached_property
+    def edge_arrays(self) -> tuple:
+        return get_edge_arrays(self.G)
+
+    @cached_property
+    def pair_weights(self) -> np.ndarray:
+        return get_pair_weights(self.G)
+
+    @cached_property
+    def cut_profile(self) -> list:
+        return get_cut_profile(self.G, context=self)
+
+    @cached_property
+    def matching_profile(self) -> list:
+        return matching_profile(self.G, context=self)
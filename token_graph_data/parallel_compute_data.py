@@ -1,27 +1,54 @@
+import glob
 import json
+import mmap
+import os
+import signal
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from math import comb
 import networkx as nx
+import orjson  # noqa: F401 -- encode_record writes with orjson; fail here, not once per graph
+from networkx.readwrite.graph6 import data_to_n
 from tqdm import tqdm
-from typing import Dict, Union, List, Generator
+from typing import Dict, Union, List, Generator, Iterable, Optional, Tuple
 import argparse
 import multiprocessing as mp
 from pathlib import Path
-import jsonpickle
 from utils import * 
+from shared_templates import (attach_token_graph_templates, peak_rss_mb, publish_token_graph_templates,
+                              release_token_graph_templates, template_keys)
+from checkpoint import Checkpoint, file_size
+from columnar_store import columnar_path, jsonl_to_columnar
+from record_codec import encode_record
+from scheduling import CostModel, graph_cost_features, lpt_bins, simulate_wall_time, sum_features
 
-def process_single_graph(data: Union[str, bytes], is_g6: bool) -> dict:
-    """Process a single graph from either G6 or JSON format."""
-    try:
-        if is_g6:
-            G = read_graph_from_g6_line(data)
-        else:
-            G = read_graph_from_json(data)
-        
-        # Compute all graph invariants
-        result = graph_data_all_k(G)
-        return result
-    except Exception as e:
-        print(f"Error processing graph: {e}")
-        return None
+def read_graph(data: Union[str, bytes], is_g6: bool) -> nx.Graph:
+    """Parse a single graph from either G6 or JSON format."""
+    if is_g6:
+        return read_graph_from_g6_line(data)
+    return read_graph_from_json(data)
+
+
+def graph_order(data: Union[str, bytes], is_g6: bool) -> int:
+    """Number of vertices of a G6 or JSON graph line, without building the graph."""
+    if is_g6:
+        raw = data.strip().encode('ascii') if isinstance(data, str) else data.strip()
+        if raw.startswith(b'>>graph6<<'):
+            raw = raw[len(b'>>graph6<<'):]
+        n, _ = data_to_n([c - 63 for c in raw[:8]])
+        return n
+    return len(json.loads(data)["nodes"])
+
+
+def graph_size(data: Union[str, bytes], is_g6: bool) -> Tuple[int, int]:
+    """(number of vertices, number of edges) of a G6 or JSON graph line."""
+    if is_g6:
+        G = read_graph_from_g6_line(data)
+        return G.number_of_nodes(), G.number_of_edges()
+    graph = json.loads(data)
+    return len(graph["nodes"]), len(graph["edges"])
 
 
 def batch_reader(file_path: str, batch_size: int = 1000) -> Generator[List[str], None, None]:
@@ -40,86 +67,688 @@ def batch_reader(file_path: str, batch_size: int = 1000) -> Generator[List[str],
         if batch:
             yield batch
 
-def process_batch(batch: List[str], is_g6: bool, worker_id: int) -> List[dict]:
-    """Process a batch of graphs."""
-    results = []
-    for data in batch:
+class GraphTimeout(Exception):
+    """Raised inside a worker when a graph exceeds its wall-clock budget."""
+
+
+@contextmanager
+def time_budget(seconds: Optional[float]):
+    """
+    Raise GraphTimeout in the body once seconds of wall-clock time have passed.
+    Uses SIGALRM, so it only applies in the main thread on POSIX systems; with
+    seconds None (or elsewhere) the body runs unbounded. ARPACK hands control
+    back to Python every iteration, so stalled eigsh runs are interrupted too.
+    """
+    if not seconds or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise GraphTimeout(f"timed out after {seconds:g} s")
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def failure_reason(e: Exception) -> str:
+    if isinstance(e, GraphTimeout):
+        return str(e)
+    return f"{type(e).__name__}: {e}"
+
+
+def compute_with_fallback(compute, timeout: Optional[float], worker_id: int, what: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    compute(fallback=False) within the timeout budget and, if that fails or times
+    out, once more as compute(fallback=True) with the fallback solver. Returns
+    (result, None) or (None, reason for both failures).
+    """
+    try:
+        with time_budget(timeout):
+            return compute(False), None
+    except Exception as e:
+        reason = failure_reason(e)
+    print(f"Worker {worker_id}: {what} failed ({reason}), retrying with the fallback solver")
+    try:
+        with time_budget(timeout):
+            return compute(True), None
+    except Exception as e:
+        reason += f"; fallback: {failure_reason(e)}"
+    print(f"Worker {worker_id}: Error processing {what}: {reason}")
+    return None, reason
+
+
+# Memory maps of the input files this worker has read ranges from, by path.
+_MAPPED_INPUTS = {}
+
+def read_range_lines(input_file: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    The non-empty lines of bytes [start, end) of input_file, stripped, with the
+    byte offset each starts at. The file is memory-mapped once per process.
+    """
+    if input_file not in _MAPPED_INPUTS:
+        with open(input_file, 'rb') as f:
+            _MAPPED_INPUTS[input_file] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    lines = []
+    offset = start
+    for raw in _MAPPED_INPUTS[input_file][start:end].split(b'\n'):
+        line = raw.strip()
+        if line:
+            lines.append((offset, line.decode()))
+        offset += len(raw) + 1
+    return lines
+
+def input_ranges(input_file: str, range_bytes: int) -> Generator[Tuple[int, int], None, None]:
+    """
+    Split input_file into consecutive byte ranges [start, end) of about
+    range_bytes, each ending just after a newline (or at the end of the file).
+    Only the pages around the boundaries are read.
+    """
+    size = os.path.getsize(input_file)
+    if size == 0:
+        return
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = start + range_bytes
+            if end >= size:
+                end = size
+            else:
+                newline = mm.find(b'\n', end - 1)
+                end = size if newline < 0 else newline + 1
+            yield start, end
+            start = end
+
+def estimate_range_bytes(input_file: str, graphs_per_range: int, sample_bytes: int = 1 << 16) -> int:
+    """Byte range size holding about graphs_per_range lines, from the line length at the start of the file."""
+    with open(input_file, 'rb') as f:
+        sample = f.read(sample_bytes)
+    line_bytes = len(sample) / max(1, sample.count(b'\n'))
+    return max(1, int(line_bytes * graphs_per_range))
+
+# Where a worker wrote one encoded record: shard number, byte offset and length.
+ShardSpan = namedtuple("ShardSpan", ["shard", "offset", "length"])
+
+# (shard number, open file, compact) of this worker's output shard, if it writes one.
+_SHARD = None
+
+def shard_path(shard_prefix: str, shard: int) -> str:
+    """A worker's output shard; not *.jsonl, so a leftover shard is never taken for a results file."""
+    return f"{shard_prefix}.part-{shard:03d}.shard"
+
+def init_worker(descriptors: Dict, shard_prefix: str = None, shard_counter=None, compact: bool = False) -> None:
+    """
+    Pool initializer: attach the shared token-graph templates and, with
+    shard_prefix, open this worker's own output shard, numbered from
+    shard_counter (a shared multiprocessing.Value), to which records are
+    written in the compact layout if compact (see record_codec).
+    """
+    global _SHARD
+    attach_token_graph_templates(descriptors)
+    if shard_prefix is not None:
+        with shard_counter.get_lock():
+            shard = shard_counter.value
+            shard_counter.value += 1
+        _SHARD = (shard, open(shard_path(shard_prefix, shard), 'wb'), compact)
+
+def write_to_shard(results: List[Optional[dict]]) -> List[Optional[ShardSpan]]:
+    """
+    Encode results into this worker's shard (if it has one) and return their
+    ShardSpans in their place; None entries stay None. The shard is flushed so
+    the parent can copy the spans as soon as the task is back.
+    """
+    if _SHARD is None:
+        return results
+    shard, f, compact = _SHARD
+    spans = []
+    for result in results:
+        if result is None:
+            spans.append(None)
+            continue
+        data = encode_record(result, compact)
+        spans.append(ShardSpan(shard, f.tell(), len(data)))
+        f.write(data)
+    f.flush()
+    return spans
+
+def process_batch(batch: List[str], is_g6: bool, worker_id: int, backend: str = "auto",
+                  stats: Dict = None, timeout: float = None, errors: Dict[int, str] = None) -> List[Optional[dict]]:
+    """
+    Process a batch of graphs. Small token graphs of the same (n, k) are solved
+    together with one stacked eigvalsh (see graph_data_batch); if that fails or
+    takes longer than timeout seconds per graph, the batch is redone one graph
+    at a time, each within timeout and retried once with the fallback solver
+    (see compute_with_fallback), so only the offending graphs are lost.
+
+    Returns one entry per input line, None where the graph failed; errors, if
+    given, receives the reason for each of those positions. If stats is given
+    it receives the batch's cost "features" (see scheduling) and its per-stage
+    "seconds".
+    """
+    errors = {} if errors is None else errors
+    results = [None] * len(batch)
+    graphs, positions = [], []
+    for i, data in enumerate(batch):
         try:
-            result = process_single_graph(data, is_g6)
-            if result is not None:
-                results.append(result)
+            graphs.append(read_graph(data, is_g6))
+            positions.append(i)
         except Exception as e:
-            print(f"Worker {worker_id}: Error processing graph: {e}")
+            print(f"Worker {worker_id}: Error reading graph: {e}")
+            errors[i] = f"unreadable: {failure_reason(e)}"
+
+    if stats is not None:
+        stats["features"] = sum_features([graph_cost_features(G.number_of_nodes(), G.number_of_edges())
+                                          for G in graphs])
+    stage_times = {}
+    try:
+        with time_budget(timeout and timeout * len(graphs)):
+            batch_results = graph_data_batch(graphs, backend, stage_times)
+        for i, result in zip(positions, batch_results):
+            results[i] = result
+        if stats is not None:
+            stats["seconds"] = stage_times
+        return results
+    except Exception as e:
+        print(f"Worker {worker_id}: Batched processing failed ({failure_reason(e)}), retrying graph by graph")
+
+    for i, G in zip(positions, graphs):
+        results[i], reason = compute_with_fallback(lambda fallback: graph_data_all_k(G, backend, fallback=fallback),
+                                                   timeout, worker_id, "graph")
+        if reason is not None:
+            errors[i] = reason
     return results
 
-def process_file_batched(input_file: str, output_file: str, num_workers: int, batch_size: int = 1000):
-    """Process graphs from input file in batches with multiple workers."""
+def process_graph_part(data: Union[str, bytes], is_g6: bool, part, worker_id: int, backend: str = "auto",
+                       stats: Dict = None, timeout: float = None, errors: Dict[int, str] = None) -> Optional[dict]:
+    """
+    graph_data_part of one graph line: its summary (part == "summary") or its
+    spectrum for k = part, within timeout seconds and retried once with the
+    fallback solver. Returns None if the graph fails (the reason goes to
+    errors[0]); stats as in process_batch.
+    """
+    errors = {} if errors is None else errors
+    start = time.perf_counter()
+    try:
+        G = read_graph(data, is_g6)
+    except Exception as e:
+        print(f"Worker {worker_id}: Error reading graph: {e}")
+        errors[0] = f"unreadable: {failure_reason(e)}"
+        return None
+    result, reason = compute_with_fallback(lambda fallback: graph_data_part(G, part, backend, fallback=fallback),
+                                           timeout, worker_id, f"part {part} of graph")
+    if reason is not None:
+        errors[0] = f"part {part}: {reason}"
+    elif stats is not None:
+        n, m = G.number_of_nodes(), G.number_of_edges()
+        seconds = time.perf_counter() - start
+        if part == "summary":
+            stats["features"] = graph_cost_features(n, m, ks=())
+            stats["seconds"] = {"invariants": seconds, "spectra": 0.0}
+        else:
+            stats["features"] = graph_cost_features(n, m, ks=(part,), invariants=False)
+            stats["seconds"] = {"invariants": 0.0, "spectra": seconds}
+    return result
+
+def process_batch_with_stats(task: Tuple[List[Tuple[int, str]], bool, int, str, Optional[Tuple], Optional[float]]) -> Dict:
+    """
+    Run one task = (items, is_g6, worker_id, backend, part, timeout), where
+    items are (input index, line) pairs and timeout the per-graph budget.
+
+    With part None the items go through process_batch and the result holds
+    "results": [(input index, record or None)]. Otherwise part = (part,
+    num_parts) names one piece of the single item (see split_graph_tasks) and
+    the result holds "part": (input index, part, num_parts, value or None).
+    If the worker writes an output shard, records are returned as their
+    ShardSpans (see write_to_shard); parts always come back whole.
+    Both also carry "errors": [(input index, line, reason)] for failures,
+    "pid", "rss" (peak RSS of the worker in MiB) and the cost "features" and
+    "seconds" of the task.
+    """
+    items, is_g6, worker_id, backend, part, timeout = task
+    stats, errors = {}, {}
+    if part is None:
+        results = process_batch([line for _, line in items], is_g6, worker_id, backend, stats, timeout, errors)
+        stats["results"] = [(index, result) for (index, _), result in zip(items, write_to_shard(results))]
+    else:
+        (index, line), = items
+        value = process_graph_part(line, is_g6, part[0], worker_id, backend, stats, timeout, errors)
+        stats["part"] = (index, part[0], part[1], value)
+    stats.update(errors=[items[i] + (reason,) for i, reason in errors.items()],
+                 pid=os.getpid(), rss=peak_rss_mb())
+    return stats
+
+def process_range_with_stats(task: Tuple[int, int, int, str, bool, int, str, Optional[float]]) -> Dict:
+    """
+    --mmap counterpart of process_batch_with_stats for task = (range id, start,
+    end, input_file, is_g6, worker_id, backend, timeout): the worker reads and
+    decodes bytes [start, end) of input_file itself. The result holds "range":
+    (range id, records, failures), with failures as failed-file entries keyed
+    by the byte offset of the graph's line, and "pid", "rss", "features" and
+    "seconds" as in process_batch_with_stats.
+    """
+    range_id, start, end, input_file, is_g6, worker_id, backend, timeout = task
+    stats, errors = {}, {}
+    lines = read_range_lines(input_file, start, end)
+    results = process_batch([line for _, line in lines], is_g6, worker_id, backend, stats, timeout, errors)
+    failures = [{"offset": lines[i][0], "graph": lines[i][1], "reason": reason} for i, reason in sorted(errors.items())]
+    records = write_to_shard([result for result in results if result is not None])
+    stats.update(range=(range_id, records, failures),
+                 pid=os.getpid(), rss=peak_rss_mb())
+    return stats
+
+def predict_line_cost(model: CostModel, data: Union[str, bytes], is_g6: bool) -> float:
+    """Predicted seconds for one graph line; 0 if the line cannot be read (process_batch reports it)."""
+    try:
+        return model.predict(graph_cost_features(*graph_size(data, is_g6)))
+    except Exception:
+        return 0.0
+
+def make_tasks(items: List[Tuple[int, str]], is_g6: bool, chunk_size: int, schedule: str = "fifo",
+               model: CostModel = None) -> List[Tuple[List[Tuple[int, str]], Optional[float]]]:
+    """
+    Split a window of (input index, line) items into tasks of about chunk_size
+    graphs, each with its predicted cost (None without a model).
+
+    "fifo" keeps input order in equal-size chunks. "lpt" predicts every graph's
+    cost with model, bins the window longest-processing-time-first into chunks
+    of balanced cost and returns the most expensive chunk first.
+    """
+    num_tasks = (len(items) + chunk_size - 1) // chunk_size
+    if model is None:
+        return [(items[i:i + chunk_size], None) for i in range(0, len(items), chunk_size)]
+    costs = [predict_line_cost(model, line, is_g6) for _, line in items]
+    if schedule == "lpt":
+        bins = lpt_bins(costs, num_tasks)
+    else:
+        bins = [list(range(i, min(i + chunk_size, len(items)))) for i in range(0, len(items), chunk_size)]
+    return [([items[i] for i in members], sum(costs[i] for i in members)) for members in bins]
+
+def split_graph_tasks(index: int, line: str, n: int, num_edges: int,
+                      model: CostModel = None) -> List[Tuple[List[Tuple[int, str]], Tuple, Optional[float]]]:
+    """
+    The independent tasks of one graph too large for a single task: one
+    (graph, k) spectrum task per k, largest token graph first, and the
+    graph-level "summary" task. Each is (items, (part, num_parts), predicted
+    cost or None without a model).
+    """
+    parts = list(range(n // 2, 0, -1)) + ["summary"]
+    tasks = []
+    for part in parts:
+        if model is None:
+            cost = None
+        elif part == "summary":
+            cost = model.predict(graph_cost_features(n, num_edges, ks=()))
+        else:
+            cost = model.predict(graph_cost_features(n, num_edges, ks=(part,), invariants=False))
+        tasks.append(([(index, line)], (part, len(parts)), cost))
+    return tasks
+
+def window_tasks(items: List[Tuple[int, str]], is_g6: bool, chunk_size: int, schedule: str = "fifo",
+                 model: CostModel = None, split_min_dim: int = None) -> List[Tuple]:
+    """
+    All tasks for a window of (input index, line) items as (items, part,
+    predicted cost): graphs whose largest token graph C(n, n/2) has at least
+    split_min_dim vertices are split by split_graph_tasks, the rest are
+    chunked by make_tasks (part None). Under the "lpt" schedule the split
+    tasks are merged into the chunks by decreasing cost, otherwise they go
+    first.
+    """
+    split, whole = [], []
+    for index, line in items:
+        try:
+            n = graph_order(line, is_g6) if split_min_dim else 0
+            if split_min_dim and comb(n, n // 2) >= split_min_dim:
+                split += split_graph_tasks(index, line, *graph_size(line, is_g6), model)
+                continue
+        except Exception:
+            pass        # unreadable (possibly only past the header); process_batch reports it
+        whole.append((index, line))
+    tasks = split + [(chunk, None, cost) for chunk, cost in make_tasks(whole, is_g6, chunk_size, schedule, model)]
+    if schedule == "lpt" and model is not None:
+        tasks.sort(key=lambda task: -task[2])
+    return tasks
+
+def checkpoint_path(output_file: Union[str, Path]) -> Path:
+    """Progress sidecar of output_file for --resume: <output_file>.checkpoint."""
+    output_file = Path(output_file)
+    return output_file.with_name(output_file.name + ".checkpoint")
+
+def failed_graphs_path(output_file: Union[str, Path]) -> Path:
+    """
+    Side file listing the graphs that failed for output_file: <output_file>.failed
+    (JSON lines, but not *.jsonl so the conjecture tests never pick it up).
+    """
+    output_file = Path(output_file)
+    return output_file.with_name(output_file.name + ".failed")
+
+def bounded(tasks: Iterable, slots: threading.Semaphore) -> Generator:
+    """Yield from tasks, taking one of slots per task; the consumer releases it per result."""
+    for task in tasks:
+        slots.acquire()
+        yield task
+
+def process_file_batched(input_file: str, output_file: str, num_workers: int, batch_size: int = 1000,
+                         backend: str = "auto", share_templates: bool = False, ordered: bool = True,
+                         max_in_flight: int = None, schedule: str = "fifo", cost_model: str = None,
+                         split_min_dim: int = None, timeout: float = None, resume: bool = False,
+                         use_mmap: bool = False, shards: bool = False, compact: bool = False,
+                         columnar: bool = False):
+    """
+    Process graphs from input file with one long-lived pool of workers.
+
+    The file is read in windows of batch_size graphs; each window is split into
+    tasks of about batch_size // num_workers graphs by make_tasks ("fifo" or
+    cost-balanced "lpt" schedule) and streamed through imap_unordered. At most
+    max_in_flight tasks (default 2 * num_workers) are queued or running at once,
+    so memory stays bounded while workers never wait for a whole batch to
+    finish. Results are appended as they arrive, or in input order through a
+    reorder buffer when ordered is True. In that case a window is only
+    dispatched once every window before the previous one has been written
+    (and a byte range once the range max_in_flight places earlier has been),
+    so a slow task at the head cannot make the buffer hold the rest of the file.
+
+    With schedule "lpt" or a cost_model file, the cost model is loaded from
+    cost_model (if the file exists), refitted from the stage timings the
+    workers report, and saved back there at the end.
+
+    Graphs whose largest token graph has at least split_min_dim vertices are
+    not processed in one task but as one task per k plus one for the
+    graph-level invariants (see split_graph_tasks), so a few huge graphs can
+    keep every worker busy; their records are reassembled with
+    assemble_graph_data once all parts are back.
+
+    Each graph gets timeout seconds of wall-clock time (default unlimited) and
+    one retry with the fallback solver. Graphs that still fail are left out of
+    the output and listed with the reason in failed_graphs_path(output_file),
+    one JSON object {"index": 0-based index of the line among the non-empty
+    input lines (blank lines are not counted), "graph": the input line, "reason"}
+    per line; the file is only created if some graph fails.
+
+    Progress is recorded in checkpoint_path(output_file) after a write at most
+    every checkpoint.SAVE_INTERVAL seconds, and the checkpoint is deleted once
+    the run completes (see checkpoint.Checkpoint). With resume, the output and failed files are cut
+    back to the last checkpoint and only the graphs it does not cover are
+    processed and appended; otherwise the run starts from scratch. Resuming an
+    output that has results but no checkpoint (a completed run) raises
+    ValueError instead of discarding them.
+
+    With use_mmap the parent does not read the input at all (except for the
+    orders needed by share_templates): it splits the memory-mapped file into
+    newline-aligned byte ranges of about batch_size // num_workers graphs and
+    every worker reads and decodes its own ranges (process_range_with_stats).
+    Ranges are then the unit of ordering and checkpointing; schedule "lpt" and
+    split_min_dim need the parent to look at each graph and do not apply, and
+    failed graphs are identified by "offset", the byte offset of their line in
+    the input, instead of "index".
+
+    With shards, every worker encodes its records into its own
+    <output stem>.part-NNN.shard and only sends back where each record is
+    (ShardSpan); the parent copies those bytes into the output in the same
+    order and at the same time it would have written the records itself, so
+    ordering and checkpoints are unchanged, and deletes the shards at the end.
+
+    Records are written with record_codec.encode_record, in its compact
+    layout (graph6 or edge list, per-k rows) if compact. With columnar, the
+    finished output is also converted into a memory-mappable columnar store
+    next to it (see columnar_store).
+
+    With share_templates, the token-graph templates for every order found in the
+    file are built once here and handed to the workers through shared memory.
+    """
     # Determine file format based on extension
     is_g6 = not input_file.endswith('.jsonl')
-    
-    # Create output file (or truncate if it exists)
-    with open(output_file, 'w') as f:
-        pass
+    failed_file = failed_graphs_path(output_file)
+    num_failed = 0
+    chunk_size = max(1, batch_size // num_workers)
+    range_bytes = estimate_range_bytes(input_file, chunk_size) if use_mmap else None
+    unit = f"bytes:{range_bytes}" if use_mmap else "lines"
+
+    if resume:
+        if not checkpoint_path(output_file).exists() and (file_size(output_file) or file_size(failed_file)):
+            # completed runs delete their checkpoint; never cut a finished output back to nothing
+            raise ValueError(f"{output_file} has results but no checkpoint, so the run that wrote it "
+                             f"completed; rerun without --resume to recompute it")
+        checkpoint = Checkpoint.load(checkpoint_path(output_file), input_file)
+        if len(checkpoint):
+            if use_mmap != checkpoint.unit.startswith("bytes:"):
+                raise ValueError(f"{output_file} was started {'without' if use_mmap else 'with'} --mmap; "
+                                 f"resume it the same way")
+            unit = checkpoint.unit      # keep the byte ranges of the interrupted run
+            range_bytes = int(unit.split(":")[1]) if use_mmap else None
+        checkpoint.unit = unit
+        checkpoint.truncate(output_file, failed_file)
+        print(f"Resuming after {len(checkpoint)} {'byte ranges' if use_mmap else 'graphs'} already processed")
+    else:
+        # Create output file (or truncate if it exists)
+        with open(output_file, 'w') as f:
+            pass
+        failed_file.unlink(missing_ok=True)
+        checkpoint = Checkpoint(checkpoint_path(output_file), input_file, unit)
+    checkpoint.save(output_file, failed_file)
     
     total_processed = 0
-    total_batches = 0
-    
-    # Count total lines once
-    print("Counting total graphs in file...")
-    with open(input_file, 'r') as f:
-        total_lines = sum(1 for _ in f)
-    estimated_batches = (total_lines + batch_size - 1) // batch_size
-    print(f"Found {total_lines} total graphs, will process in approximately {estimated_batches} batches")
-    
-    # Create the progress bar after showing count message
-    batch_pbar = tqdm(
-        desc=f"Processing {estimated_batches} batches", 
-        unit="batch", 
-        total=estimated_batches
-    )
+    total_read = 0
     
-    # Process file in batches
-    for batch_num, batch in enumerate(batch_reader(input_file, batch_size)):
-        total_batches += 1
-        batch_size_actual = len(batch)
-        
-        # Split the batch into smaller chunks for workers
-        chunk_size = max(1, batch_size_actual // num_workers)
-        chunks = [batch[i:i+chunk_size] for i in range(0, batch_size_actual, chunk_size)]
-        
-        # Process chunks in parallel
-        with mp.Pool(num_workers) as pool:
-            results = pool.starmap(
-                process_batch,
-                [(chunk, is_g6, i) for i, chunk in enumerate(chunks)]
-            )
-        
-        # Flatten results from all workers
-        flat_results = [r for worker_results in results for r in worker_results]
-        batch_processed = len(flat_results)
-        
-        # Append results to output file
-        with open(output_file, 'a') as f:
-            for result in flat_results:
-                # Consistently use jsonpickle
-                json_str = jsonpickle.encode(result, unpicklable=False)
-                f.write(json_str + '\n')
-        
-        total_processed += batch_processed
-        
-        # Update progress bar description with current stats
-        batch_pbar.set_description(
-            f"Batch {batch_num+1}/{estimated_batches}: {batch_processed}/{batch_size_actual} graphs, total: {total_processed}/{total_lines}"
-        )
-        
-        # Update progress bar
-        batch_pbar.update(1)
+    # Count total lines once (and collect graph orders for the shared templates)
+    orders = set()
+    total_lines = None
+    if not use_mmap or share_templates:
+        print("Counting total graphs in file...")
+        total_lines = 0
+        with open(input_file, 'r') as f:
+            for line in f:
+                total_lines += 1
+                if share_templates and line.strip():
+                    orders.add(graph_order(line, is_g6))
+    if use_mmap:
+        if schedule == "lpt" or split_min_dim:
+            print("Note: --mmap dispatches byte ranges in file order; --schedule lpt and --split_min_dim are ignored")
+        print(f"Workers read byte ranges of {range_bytes} bytes (about {chunk_size} graphs) of the mapped file")
+        total_lines = None      # progress counts graphs, not ranges
+    else:
+        print(f"Found {total_lines} total graphs, will process them in chunks of {chunk_size} ({schedule} schedule)")
     
-    # Close progress bar
-    batch_pbar.close()
+    if share_templates:
+        keys = template_keys(orders, backend)
+        print(f"Sharing {len(keys)} token-graph templates with the workers")
+        blocks, descriptors = publish_token_graph_templates(keys)
+    else:
+        blocks, descriptors = [], {}
+    if shards:
+        shard_prefix = str(Path(output_file).with_suffix(''))
+        for stale in glob.glob(glob.escape(shard_prefix) + ".part-*.shard"):
+            os.remove(stale)
+        initargs = (descriptors, shard_prefix, mp.Value('i', 0), compact)
+    else:
+        shard_prefix, initargs = None, (descriptors,)
+    shard_fds = {}      # shard number -> read-only descriptor in the parent
+    worker_peak_rss = {}
+    learn_costs = schedule == "lpt" or bool(cost_model)
+    model = CostModel.load(cost_model) if learn_costs else None
+    in_flight = max_in_flight or 2 * num_workers
+    slots = threading.Semaphore(in_flight)
+    # finished and pending units are input index -> (records, failed-file entries)
+    pending, next_index = {}, checkpoint.watermark
+    written = threading.Condition()        # notified whenever next_index advances
+    stopped = False
+
+    def wait_until_written(index):
+        """In ordered mode, hold dispatch back until every input unit before index has been written."""
+        if ordered:
+            with written:
+                written.wait_for(lambda: stopped or next_index >= index)
+
+    def stop_dispatch():
+        """Unblock a dispatcher still waiting for slots or writes, so the pool can shut down."""
+        nonlocal stopped
+        with written:
+            stopped = True
+            written.notify_all()
+        for _ in range(in_flight):
+            slots.release()
+
+    def range_tasks():
+        for range_id, (start, end) in enumerate(input_ranges(input_file, range_bytes)):
+            if range_id not in checkpoint:
+                wait_until_written(range_id - in_flight)
+                yield range_id, start, end, input_file, is_g6, range_id, backend, timeout
+
+    def tasks():
+        offset, previous_window, task_id = 0, 0, 0
+        for window in batch_reader(input_file, batch_size):
+            items = [item for item in enumerate(window, start=offset) if item[0] not in checkpoint]
+            wait_until_written(previous_window)
+            previous_window = offset
+            offset += len(window)
+            for chunk, part, _ in window_tasks(items, is_g6, chunk_size, schedule,
+                                               model if schedule == "lpt" else None, split_min_dim):
+                yield chunk, is_g6, task_id, backend, part, timeout
+                task_id += 1
+
+    try:
+        # Create the progress bar after showing count message
+        pbar = tqdm(desc="Processing graphs", unit="graph", total=total_lines,
+                    initial=0 if use_mmap else len(checkpoint))
+        parts = {}      # input index of a split graph -> {part: value} received so far
+        part_errors = {}        # input index of a split graph -> reasons of its failed parts
+
+        worker = process_range_with_stats if use_mmap else process_batch_with_stats
+        with mp.Pool(num_workers, initializer=init_worker, initargs=initargs) as pool, \
+                open(output_file, 'ab') as f:
+            try:
+                for out in pool.imap_unordered(worker, bounded(range_tasks() if use_mmap else tasks(), slots)):
+                    slots.release()
+                    worker_peak_rss[out["pid"]] = max(worker_peak_rss.get(out["pid"], 0.0), out["rss"])
+                    if learn_costs and "seconds" in out:
+                        model.observe(out["features"], out["seconds"])
+
+                    finished = {}
+                    if "range" in out:
+                        range_id, records, failures = out["range"]
+                        finished[range_id] = (records, failures)
+                    elif "part" in out:
+                        index, part, num_parts, value = out["part"]
+                        received = parts.setdefault(index, {})
+                        received[part] = value
+                        part_errors.setdefault(index, []).extend(out["errors"])
+                        if len(received) == num_parts:
+                            del parts[index]
+                            summary = received.pop("summary")
+                            errors = part_errors.pop(index)
+                            if errors:
+                                reason = "; ".join(reason for *_, reason in errors)
+                                finished[index] = ([], [{"index": index, "graph": errors[0][1], "reason": reason}])
+                            else:
+                                finished[index] = ([assemble_graph_data(summary, received)], [])
+                    else:
+                        errors = {index: (line, reason) for index, line, reason in out["errors"]}
+                        for index, result in out["results"]:
+                            if result is not None:
+                                finished[index] = ([result], [])
+                            else:
+                                line, reason = errors[index]
+                                finished[index] = ([], [{"index": index, "graph": line, "reason": reason}])
+
+                    if ordered:
+                        # hold results back until every earlier input has been written
+                        pending.update(finished)
+                        ready = {}
+                        with written:
+                            while next_index in pending or next_index in checkpoint:
+                                if next_index in pending:
+                                    ready[next_index] = pending.pop(next_index)
+                                next_index += 1
+                            written.notify_all()
+                    else:
+                        ready = finished
+
+                    failures = [failure for _, unit_failures in ready.values() for failure in unit_failures]
+                    if failures:
+                        with open(failed_file, 'a') as failed:
+                            for failure in failures:
+                                failed.write(json.dumps(failure) + '\n')
+                        num_failed += len(failures)
+
+                    for records, _ in ready.values():
+                        for result in records:
+                            if isinstance(result, ShardSpan):
+                                if result.shard not in shard_fds:
+                                    shard_fds[result.shard] = os.open(shard_path(shard_prefix, result.shard), os.O_RDONLY)
+                                f.write(os.pread(shard_fds[result.shard], result.length, result.offset))
+                            else:
+                                f.write(encode_record(result, compact))
+                    f.flush()
+                    if ready:
+                        checkpoint.mark_done(ready)
+                        checkpoint.save_if_due(output_file, failed_file)
+
+                    num_records = sum(len(records) for records, _ in finished.values())
+                    num_graphs = num_records + sum(len(failures) for _, failures in finished.values())
+                    total_read += num_graphs
+                    total_processed += num_records
+                    pbar.set_description(f"Processed {total_processed}/{total_read} graphs read")
+                    pbar.update(num_graphs)
+            finally:
+                stop_dispatch()
+
+        # Close progress bar
+        pbar.close()
+        for shard, fd in shard_fds.items():
+            os.close(fd)
+        if shards:
+            for shard in glob.glob(glob.escape(shard_prefix) + ".part-*.shard"):
+                os.remove(shard)
+        checkpoint.remove()
+    finally:
+        release_token_graph_templates(blocks)
+
+    if worker_peak_rss:
+        rss = list(worker_peak_rss.values())
+        print(f"Peak RSS per worker: max {max(rss):.1f} MiB, mean {sum(rss) / len(rss):.1f} MiB "
+              f"over {len(rss)} worker processes (parent: {peak_rss_mb():.1f} MiB)")
+    if cost_model:
+        model.save(cost_model)
+        print(f"Cost model coefficients saved to {cost_model}")
     
-    print(f"All done! Processed {total_processed} graphs across {total_batches} batches.")
+    print(f"All done! Processed {total_processed} of {total_read} graphs.")
     print(f"Results written to {output_file}")
+    if columnar:
+        directory = columnar_path(output_file)
+        manifest = jsonl_to_columnar(output_file, directory, source={"input_file": str(input_file)})
+        print(f"Columnar store with {manifest['rows']} graphs in {len(manifest['shards'])} shards written to {directory}")
+    if num_failed:
+        print(f"{num_failed} failed or timed-out graphs listed in {failed_file}")
+
+def plan_file(input_file: str, num_workers: int, batch_size: int = 1000, schedule: str = "fifo",
+              cost_model: str = None, split_min_dim: int = None) -> Tuple[float, float]:
+    """
+    Dry run of process_file_batched: predict every graph's cost, form the same
+    tasks and simulate dispatching them to num_workers workers. Prints and
+    returns the predicted (wall seconds, CPU seconds).
+    """
+    is_g6 = not input_file.endswith('.jsonl')
+    model = CostModel.load(cost_model)
+    chunk_size = max(1, batch_size // num_workers)
+    task_costs, orders = [], {}
+    offset = 0
+    for window in batch_reader(input_file, batch_size):
+        items = list(enumerate(window, start=offset))
+        offset += len(window)
+        for line in window:
+            n = graph_order(line, is_g6)
+            orders[n] = orders.get(n, 0) + 1
+        task_costs += [cost for _, _, cost in window_tasks(items, is_g6, chunk_size, schedule, model,
+                                                           split_min_dim)]
+
+    wall, cpu = simulate_wall_time(task_costs, num_workers)
+    print(f"Plan for {input_file}: {offset} graphs in {len(task_costs)} tasks ({schedule} schedule)")
+    print("Graphs per order: " + ", ".join(f"n={n}: {count}" for n, count in sorted(orders.items())))
+    print(f"Predicted CPU time {cpu:.1f} s, wall time {wall:.1f} s on {num_workers} workers")
+    return wall, cpu
 
 def process_graphs_cli():
     """Command-line interface for processing graph files."""
@@ -129,7 +758,39 @@ def process_graphs_cli():
     parser.add_argument('--workers', '-w', type=int, default=mp.cpu_count(), 
                         help=f'Number of worker processes (default: {mp.cpu_count()})')
     parser.add_argument('--batch_size', '-b', type=int, default=1000,
-                        help='Number of graphs to process in each batch (default: 1000)')
+                        help='Graphs per batch; each task gets batch_size / workers of them (default: 1000)')
+    parser.add_argument('--schedule', default='fifo', choices=['fifo', 'lpt'],
+                        help='fifo: equal-size chunks in input order; lpt: cost-balanced chunks, largest first')
+    parser.add_argument('--cost_model', default=None,
+                        help='JSON file with cost-model coefficients; loaded if present, refitted and saved after a run')
+    parser.add_argument('--split_min_dim', type=int, default=None,
+                        help='Split graphs whose largest token graph has at least this many vertices '
+                             'into one task per k plus one for the invariants (default: never split)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Wall-clock budget in seconds per graph (per part with --split_min_dim); graphs over '
+                             'budget are retried once with the fallback solver (default: unlimited)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from its checkpoint instead of starting over')
+    parser.add_argument('--mmap', action='store_true',
+                        help='Memory-map the input and let each worker read its own byte ranges '
+                             '(fifo schedule, no --split_min_dim)')
+    parser.add_argument('--shards', action='store_true',
+                        help='Workers encode and write their records to their own <output>.part-NNN.shard; '
+                             'the parent only copies the bytes into the output')
+    parser.add_argument('--compact', action='store_true',
+                        help='Write records in the compact layout of record_codec (graph6 or edge list, per-k arrays)')
+    parser.add_argument('--columnar', action='store_true',
+                        help='Also write the results as a memory-mappable columnar store <output stem>.columns')
+    parser.add_argument('--plan', action='store_true',
+                        help='Only print the predicted wall time for the input file')
+    parser.add_argument('--unordered', action='store_true',
+                        help='Write results in completion order instead of input order')
+    parser.add_argument('--max_in_flight', type=int, default=None,
+                        help='Maximum number of queued or running tasks (default: 2 * workers)')
+    parser.add_argument('--share_templates', action='store_true',
+                        help='Build token-graph templates once in the parent and share them with workers')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'dense', 'csr', 'linear_operator', 'networkx'],
+                        help='Token-graph eigensolver; auto picks dense, csr or linear_operator by size (default: auto)')
     
     args = parser.parse_args()
     
@@ -144,8 +805,16 @@ def process_graphs_cli():
     
     output_file = output_dir / f"{input_path.stem}_data.jsonl"
     
+    if args.plan:
+        plan_file(args.input_file, args.workers, args.batch_size, args.schedule, args.cost_model,
+                  args.split_min_dim)
+        return
+
     # Process the file
-    process_file_batched(args.input_file, output_file, args.workers, args.batch_size)
+    process_file_batched(args.input_file, output_file, args.workers, args.batch_size, args.backend,
+                         args.share_templates, not args.unordered, args.max_in_flight,
+                         args.schedule, args.cost_model, args.split_min_dim, args.timeout,
+                         args.resume, args.mmap, args.shards, args.compact, args.columnar)
 
 if __name__ == "__main__":
     process_graphs_cli()
\ No newline at end of file
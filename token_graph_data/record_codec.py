@@ -0,0 +1,165 @@
+"""
+Encoding and decoding of *_data.jsonl records, shared by parallel_compute_data
+(writer) and test_all_conjectures (reader).
+
+Data files are written with orjson only (encode_record requires it): one
+serializer for every writer, so output files are byte-for-byte the same
+wherever they are made. Readers fall back to the json module without it.
+
+Records come in two layouts, one per line, and readers accept either:
+
+verbose (graph_data_all_k):
+    {"graph": node-link dict, "graph_invariants": {"W", "C", "M"},
+     "k_data": {"1": {"M_le_k", "C_k", "spec": {"A": {"min", "max"}, "L": ..., "Q": ...}}, ...}}
+
+compact (to_compact):
+    {"g6": graph6 string}                      unit weights and no self-loops on vertices 0..n-1, or
+    {"n": n, "edges": [[u, v, weight], ...]}   other weights or self-loops on vertices 0..n-1, or
+    {"graph": node-link dict}                  anything else,
+    plus "inv": [W, C, M] and "k": one row per k = 1..n/2 of
+    [M_le_k, C_k, A min, A max, L min, L max, Q min, Q max].
+"""
+import json
+from typing import Dict, List, Tuple, Union
+import numpy as np
+try:
+    import orjson
+except ImportError:  # readers only; encode_record needs it
+    orjson = None
+
+# Column order of a compact "k" row.
+K_FIELDS = ("M_le_k", "C_k", "A_min", "A_max", "L_min", "L_max", "Q_min", "Q_max")
+SPEC_MATRICES = ("A", "L", "Q")
+
+
+def _to_builtin(obj):
+    """orjson default hook for NumPy scalars and arrays."""
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """obj as one line of JSON (no trailing newline)."""
+    if orjson is None:
+        return json.dumps(obj, default=_to_builtin, separators=(',', ':')).encode()
+    return orjson.dumps(obj, default=_to_builtin, option=orjson.OPT_NON_STR_KEYS)
+
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def edges_to_graph6(n: int, edges: List[Tuple[int, int]]) -> str:
+    """graph6 string (no header) of the simple graph on 0..n-1 with the given edges."""
+    if n < 63:
+        prefix = [n]
+    elif n < 258048:
+        prefix = [63, (n >> 12) & 63, (n >> 6) & 63, n & 63]
+    else:
+        raise ValueError("graph6 supports at most 258047 vertices")
+    bits = np.zeros(n * (n - 1) // 2 + 5, dtype=np.uint8)   # padded to whole 6-bit groups below
+    for u, v in edges:
+        u, v = min(u, v), max(u, v)
+        bits[v * (v - 1) // 2 + u] = 1      # upper triangle, column by column
+    num_chars = (n * (n - 1) // 2 + 5) // 6
+    groups = bits[:6 * num_chars].reshape(-1, 6) @ (1 << np.arange(5, -1, -1))
+    return bytes(np.concatenate([prefix, groups]).astype(np.uint8) + 63).decode('ascii')
+
+
+def graph6_to_edges(g6: str) -> Tuple[int, List[Tuple[int, int]]]:
+    """(n, edges (u, v) with u < v in column order) of a graph6 string."""
+    data = np.frombuffer(g6.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if data[0] < 63:
+        n, data = int(data[0]), data[1:]
+    else:
+        n, data = int((data[1] << 12) | (data[2] << 6) | data[3]), data[4:]
+    bits = ((data[:, None] >> np.arange(5, -1, -1)) & 1).ravel()[:n * (n - 1) // 2]
+    v = np.repeat(np.arange(n), np.arange(n))              # column of every upper-triangle bit
+    u = np.arange(n * (n - 1) // 2) - v * (v - 1) // 2
+    set_bits = np.flatnonzero(bits)
+    return n, list(zip(u[set_bits].tolist(), v[set_bits].tolist()))
+
+
+def _plain_edges(graph: Dict) -> Union[Tuple[int, List], None]:
+    """(n, [[u, v, weight], ...]) if graph is a plain node-link graph on 0..n-1, else None."""
+    n = len(graph["nodes"])
+    if (graph.get("directed") or graph.get("multigraph") or graph.get("graph")
+            or set(graph) != {"directed", "multigraph", "graph", "nodes", "edges"}
+            or graph["nodes"] != [{"id": i} for i in range(n)]):
+        return None
+    edges = []
+    for edge in graph["edges"]:
+        if set(edge) - {"source", "target", "weight"}:
+            return None
+        edges.append([edge["source"], edge["target"], edge.get("weight", 1.0)])
+    return n, edges
+
+
+def to_compact(record: Dict) -> Dict:
+    """The compact layout of a verbose record."""
+    compact = {}
+    plain = _plain_edges(record["graph"])
+    if plain is None:
+        compact["graph"] = record["graph"]
+    elif all(weight == 1.0 and u != v for u, v, weight in plain[1]):     # graph6 has no self-loops
+        compact["g6"] = edges_to_graph6(plain[0], [(u, v) for u, v, _ in plain[1]])
+    else:
+        compact["n"], compact["edges"] = plain
+    invariants = record["graph_invariants"]
+    compact["inv"] = [invariants["W"], invariants["C"], invariants["M"]]
+    compact["k"] = [[k_dict["M_le_k"], k_dict["C_k"]]
+                    + [k_dict["spec"][name][end] for name in SPEC_MATRICES for end in ("min", "max")]
+                    for _, k_dict in sorted(record["k_data"].items(), key=lambda item: int(item[0]))]
+    return compact
+
+
+def _node_link(n: int, edges) -> Dict:
+    return {"directed": False, "multigraph": False, "graph": {},
+            "nodes": [{"id": i} for i in range(n)],
+            "edges": [{"weight": weight, "source": u, "target": v} for u, v, weight in edges]}
+
+
+def from_compact(compact: Dict) -> Dict:
+    """The verbose layout (with string k keys, as decoded from JSON) of a compact record."""
+    if "g6" in compact:
+        n, edges = graph6_to_edges(compact["g6"])
+        graph = _node_link(n, [(u, v, 1.0) for u, v in edges])
+    elif "edges" in compact:
+        graph = _node_link(compact["n"], compact["edges"])
+    else:
+        graph = compact["graph"]
+    W, C, M = compact["inv"]
+    k_data = {}
+    for k, row in enumerate(compact["k"], start=1):
+        k_data[str(k)] = {"M_le_k": row[0], "C_k": row[1],
+                          "spec": {name: {"min": row[2 + 2 * i], "max": row[3 + 2 * i]}
+                                   for i, name in enumerate(SPEC_MATRICES)}}
+    return {"graph": graph, "graph_invariants": {"W": W, "C": C, "M": M}, "k_data": k_data}
+
+
+def encode_record(record: Dict, compact: bool = False) -> bytes:
+    """One output line (with newline) for a graph_data_all_k record."""
+    if orjson is None:
+        raise ImportError("writing data files requires orjson (pip install 'orjson>=3.8')")
+    return dumps(to_compact(record) if compact else record) + b'\n'
+
+
+def decode_record(line: Union[str, bytes]) -> Dict:
+    """A record in the verbose layout from one line in either layout."""
+    record = loads(line)
+    return from_compact(record) if "k" in record else record
+
+
+if __name__ == "__main__":
+    # Round-trip self-check of the compact layouts, including self-loops (which graph6 cannot hold)
+    def _record(n, edges):
+        rows = [[1.0, 2.0, -1.0, 1.0, 0.0, 4.0, 0.0, 4.0] for _ in range(n // 2)]
+        return from_compact({"n": n, "edges": edges, "inv": [3.0, 2.0, 1.0], "k": rows})
+
+    for n, edges in [(4, [[0, 1, 1.0], [0, 2, 1.0], [1, 3, 1.0]]),
+                     (4, [[0, 1, 1.0], [1, 2, 0.5], [2, 3, 1.0]]),
+                     (4, [[0, 1, 1.0], [1, 1, 1.0], [2, 3, 1.0], [3, 3, 1.0]])]:
+        record = decode_record(encode_record(_record(n, edges)))
+        assert decode_record(encode_record(record, compact=True)) == record, edges
+        assert from_compact(to_compact(record)) == record, edges
+    print("record_codec round trips OK")
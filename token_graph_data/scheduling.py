@@ -0,0 +1,129 @@
+"""
+Cost model and longest-processing-time-first (LPT) scheduling for
+parallel_compute_data.
+
+A graph's cost is predicted per stage from its order n and size |E|:
+  - "invariants" (cut and matching profiles) grows like n * 2^n,
+  - "spectra" (token graphs for k = 1..n/2) grows like sum_k C(n, k) * |E| for
+    the sparse solvers plus sum_k C(n, k)^3 for the dense ones.
+The coefficients start from DEFAULT_COEFFICIENTS and are refitted by least
+squares from the stage timings that workers report, through running sums
+of the normal equations so each observation costs the same.
+"""
+import heapq
+import json
+import os
+from math import comb
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from compute_token_graph_spectra import select_solver
+
+STAGES = ("invariants", "spectra")
+
+# Seconds per unit of each feature in graph_cost_features, measured on a
+# single core; refine them with CostModel.observe / --cost_model.
+DEFAULT_COEFFICIENTS = {
+    "invariants": [2.0e-8, 3.0e-4],
+    "spectra": [2.0e-7, 1.0e-9, 5.0e-4],
+}
+
+
+def graph_cost_features(n: int, num_edges: int, ks: Sequence[int] = None,
+                        invariants: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Per-stage cost features of one graph:
+    {"invariants": [n * 2^n, 1], "spectra": [sum_k C(n, k) |E|, sum_dense C(n, k)^3, 1]}.
+
+    ks restricts the spectra to those k (default 1..n/2) and invariants=False
+    zeroes the invariant stage, which gives the features of a single
+    graph_data_part.
+    """
+    if ks is None:
+        ks = range(1, n // 2 + 1)
+    dims = [comb(n, k) for k in ks]
+    return {
+        "invariants": np.array([n * 2.0 ** n, 1.0]) * invariants,
+        "spectra": np.array([float(sum(dims) * num_edges),
+                             sum(float(N) ** 3 for N in dims if select_solver(N) == "dense"),
+                             float(len(dims) > 0)]),
+    }
+
+
+def sum_features(features: Sequence[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Stage-wise sum of graph_cost_features dicts (the features of a task)."""
+    return {stage: sum((f[stage] for f in features), np.zeros(len(DEFAULT_COEFFICIENTS[stage])))
+            for stage in STAGES}
+
+
+class CostModel:
+    """
+    Linear per-stage cost model, predicted seconds = sum over stages of
+    coefficients[stage] @ features[stage].
+    """
+
+    def __init__(self, coefficients: Dict[str, Sequence[float]] = None):
+        coefficients = coefficients or DEFAULT_COEFFICIENTS
+        self.coefficients = {stage: np.array(coefficients[stage], dtype=float) for stage in STAGES}
+        # per stage: number of observations, X^T X and X^T y of all of them
+        self.observations = {stage: [0, np.zeros((len(self.coefficients[stage]),) * 2),
+                                     np.zeros(len(self.coefficients[stage]))] for stage in STAGES}
+
+    def predict(self, features: Dict[str, np.ndarray]) -> float:
+        return float(sum(self.coefficients[stage] @ features[stage] for stage in STAGES))
+
+    def observe(self, features: Dict[str, np.ndarray], stage_seconds: Dict[str, float]) -> None:
+        """
+        Record the timings of one task and refit each stage's coefficients by
+        least squares over every observation so far, in O(features^3).
+        """
+        for stage in STAGES:
+            x = np.asarray(features[stage], dtype=float)
+            observed = self.observations[stage]
+            observed[0] += 1
+            observed[1] += np.outer(x, x)
+            observed[2] += x * stage_seconds[stage]
+            count, xtx, xty = observed
+            if count >= len(x):
+                # normal equations with the columns scaled to unit norm (features span many magnitudes)
+                scale = np.sqrt(np.diag(xtx))
+                scale[scale == 0] = 1.0
+                fit, *_ = np.linalg.lstsq(xtx / np.outer(scale, scale), xty / scale, rcond=None)
+                self.coefficients[stage] = np.clip(fit / scale, 0, None)
+
+    @classmethod
+    def load(cls, path: str) -> "CostModel":
+        """Model with the coefficients saved at path, or the defaults if there is none."""
+        if path and os.path.exists(path):
+            with open(path) as f:
+                return cls(json.load(f))
+        return cls()
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump({stage: coef.tolist() for stage, coef in self.coefficients.items()}, f, indent=2)
+
+
+def lpt_bins(costs: Sequence[float], num_bins: int) -> List[List[int]]:
+    """
+    Longest-processing-time-first binning: indices of costs, largest first, each
+    go to the currently lightest bin. Returns the non-empty bins, heaviest first.
+    """
+    heap = [(0.0, b) for b in range(max(1, num_bins))]
+    bins = [[] for _ in heap]
+    for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        load, b = heapq.heappop(heap)
+        bins[b].append(i)
+        heapq.heappush(heap, (load + costs[i], b))
+    load = {b: sum(costs[i] for i in members) for b, members in enumerate(bins)}
+    return [bins[b] for b in sorted(load, key=lambda b: -load[b]) if bins[b]]
+
+
+def simulate_wall_time(task_costs: Sequence[float], num_workers: int) -> Tuple[float, float]:
+    """
+    Makespan of dispatching task_costs in order to the first free of num_workers
+    workers, and the total work. Returns (wall seconds, CPU seconds).
+    """
+    workers = [0.0] * max(1, num_workers)
+    for cost in task_costs:
+        heapq.heapreplace(workers, workers[0] + cost)
+    return max(workers), float(sum(task_costs))
@@ -0,0 +1,76 @@
+"""
+Publish token-graph templates (see compute_token_graph_spectra.token_graph_template)
+to worker processes through multiprocessing.shared_memory.
+
+The parent builds each (n, k) template once and copies it into shared memory
+blocks; workers attach to them in the Pool initializer and register read-only
+NumPy views in TOKEN_GRAPH_TEMPLATES, so no worker builds or stores its own copy.
+"""
+import resource
+from math import comb
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from compute_token_graph_spectra import TOKEN_GRAPH_TEMPLATES, build_token_graph_template, select_solver
+
+# SharedMemory blocks a worker is attached to; kept alive for the views into them.
+_ATTACHED_BLOCKS = []
+
+
+def template_keys(orders: Iterable[int], backend: str = "auto") -> List[Tuple[int, int]]:
+    """The (n, k) templates a run over graphs of the given orders will use."""
+    keys = []
+    for n in sorted(set(orders)):
+        for k in range(1, n // 2 + 1):
+            solver = select_solver(comb(n, k)) if backend == "auto" else backend
+            if solver in ("dense", "csr"):
+                keys.append((n, k))
+    return keys
+
+
+def publish_token_graph_templates(keys: Iterable[Tuple[int, int]]) -> Tuple[List[shared_memory.SharedMemory], Dict]:
+    """
+    Build the templates for keys in this process and copy every array into its
+    own shared memory block.
+
+    Returns
+    -------
+    (blocks, descriptors)
+        blocks must be passed to release_token_graph_templates once the workers
+        are done; descriptors is the picklable argument for
+        attach_token_graph_templates: {(n, k): [(block name, shape, dtype), ...]}.
+    """
+    blocks, descriptors = [], {}
+    for key in keys:
+        descriptors[key] = []
+        for array in build_token_graph_template(*key):
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            blocks.append(block)
+            descriptors[key].append((block.name, array.shape, array.dtype.str))
+    return blocks, descriptors
+
+
+def attach_token_graph_templates(descriptors: Dict) -> None:
+    """Pool initializer: map the published templates as read-only NumPy views."""
+    for key, arrays in descriptors.items():
+        views = []
+        for name, shape, dtype in arrays:
+            block = shared_memory.SharedMemory(name=name)
+            _ATTACHED_BLOCKS.append(block)
+            view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            view.setflags(write=False)
+            views.append(view)
+        TOKEN_GRAPH_TEMPLATES[key] = tuple(views)
+
+
+def release_token_graph_templates(blocks: List[shared_memory.SharedMemory]) -> None:
+    """Close and unlink blocks returned by publish_token_graph_templates."""
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the calling process in MiB (ru_maxrss is KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -1,9 +1,12 @@
 import json
+import time
+from math import comb
 import networkx as nx
 from networkx.readwrite.json_graph import node_link_data, node_link_graph
-from typing import Dict, Union
+from typing import Dict, List, Union
 from compute_graph_invariants import *
 from compute_token_graph_spectra import *
+from graph_context import GraphContext
 
 
 def read_graph_from_g6_line(line: Union[str, bytes]) -> nx.Graph:
@@ -33,7 +36,8 @@ def save_graph_data_to_json(G: nx.Graph, filename: str) -> None:
         json.dump(data, f, indent=2)
 
 
-def graph_invariant_data(G: nx.Graph) -> Dict:
+def graph_invariant_data(G: nx.Graph, cut_profile: List[float] = None,
+                         context: GraphContext = None) -> Dict:
     """
     Compute basic invariants for a graph G:
 
@@ -45,6 +49,10 @@ def graph_invariant_data(G: nx.Graph) -> Dict:
     ----------
     G : networkx.Graph
         The input graph (possibly weighted).
+    cut_profile : list of float, optional
+        get_cut_profile(G), if already computed.
+    context : GraphContext, optional
+        Memoized intermediates of G (matching, cut profile).
 
     Returns
     -------
@@ -56,13 +64,15 @@ def graph_invariant_data(G: nx.Graph) -> Dict:
         }
     """
     W = get_weight_sum(G)
-    C = get_maximum_cut(G)
-    M = get_maximum_matching(G)
+    C = get_maximum_cut(G, cut_profile=cut_profile, context=context)
+    M = get_maximum_matching(G, context=context)
 
     return {"W": W, "C": C, "M": M}
 
 
-def graph_k_invariants(G: nx.Graph, k: int) -> Dict[str, float]:
+def graph_k_invariants(G: nx.Graph, k: int, cut_profile: List[float] = None,
+                       matching_profile_values: List[float] = None,
+                       context: GraphContext = None) -> Dict[str, float]:
     """
     Compute two k-constrained invariants on G:
       - M_le_k : maximum matching weight using ≤ k edges
@@ -72,6 +82,12 @@ def graph_k_invariants(G: nx.Graph, k: int) -> Dict[str, float]:
     ----------
     G : networkx.Graph
     k : int
+    cut_profile : list of float, optional
+        get_cut_profile(G), if already computed.
+    matching_profile_values : list of float, optional
+        matching_profile(G), if already computed.
+    context : GraphContext, optional
+        Memoized intermediates of G; supplies both profiles if they are not given.
 
     Returns
     -------
@@ -81,20 +97,37 @@ def graph_k_invariants(G: nx.Graph, k: int) -> Dict[str, float]:
         "C_k":    float   # max cut value when one side has size k
       }
     """
-    M_le_k = get_maximum_matching_at_most_k_edges(G, k)
-    C_k    = get_maximum_k_cut(G, k)
+    if matching_profile_values is None and context is not None:
+        matching_profile_values = context.matching_profile
+    if matching_profile_values is not None:
+        M_le_k = matching_profile_values[k]
+    else:
+        M_le_k = get_maximum_matching_at_most_k_edges(G, k)
+    C_k    = get_maximum_k_cut(G, k, cut_profile, context)
     return {
         "M_le_k": M_le_k,
         "C_k":    C_k
     }
 
-def token_graph_spectrum(G: nx.Graph, k: int) -> Dict:
+def token_graph_spectrum(G: nx.Graph, k: int, backend: str = "auto",
+                         return_solver: bool = False,
+                         dense_max_dim: int = DENSE_MAX_DIM,
+                         matrix_free_min_dim: int = MATRIX_FREE_MIN_DIM,
+                         context: GraphContext = None, tol: float = 0) -> Dict:
     """
     For the k-token graph of G, compute the min/max eigenvalues of:
       - A (adjacency)
       - L (graph Laplacian)
       - Q (signless Laplacian)
 
+    backend selects how the matrices are built and solved:
+      - "auto"     : pick one of the next three by C(n, k) against
+                     dense_max_dim / matrix_free_min_dim, see select_solver
+      - "dense"    : one numpy eigvalsh per matrix
+      - "csr"      : get_token_graph_matrices + ARPACK
+      - "linear_operator" : get_token_graph_operators, matrix-free; for large n
+      - "networkx" : get_token_graph + get_graph_matrices (reference path)
+
     Returns
     -------
     {
@@ -102,48 +135,45 @@ def token_graph_spectrum(G: nx.Graph, k: int) -> Dict:
       "L": {"min": float, "max": float},
       "Q": {"min": float, "max": float}
     }
+    and, if return_solver is True, the backend that was used as a second value.
+    context, a GraphContext of G, lets the matrix builders reuse its pair weights;
+    tol is the ARPACK tolerance of the sparse solvers (0: machine precision).
     """
-    kth_token_graph = get_token_graph(G, k)
-    A, L, Q = get_graph_matrices(kth_token_graph)
-    
-    # Extract scalar values from NumPy arrays
-    min_A = float(get_minimum_eigval(A))
-    min_A = round(min_A, 6)
-    max_A = float(get_maximum_eigval(A))
-    max_A = round(max_A, 6)
-    min_L = float(get_minimum_eigval(L))
-    min_L = round(min_L, 6)
-    max_L = float(get_maximum_eigval(L))
-    max_L = round(max_L, 6)
-    min_Q = float(get_minimum_eigval(Q))
-    min_Q = round(min_Q, 6)
-    max_Q = float(get_maximum_eigval(Q))
-    max_Q = round(max_Q, 6)
-    
+    extremes, solver = token_graph_extreme_eigvals(G, k, backend, dense_max_dim, matrix_free_min_dim,
+                                                   context, tol)
+    spectrum = format_spectrum(extremes)
+    return (spectrum, solver) if return_solver else spectrum
+
+
+def format_spectrum(extremes: Dict) -> Dict:
+    """
+    Round {"A": (min, max), ...} from token_graph_extreme_eigvals to the
+    {"A": {"min": float, "max": float}, ...} layout of token_graph_spectrum.
+    """
+    # Extract scalar values from NumPy arrays; "+ 0.0" turns a rounded -0.0
+    # (solver noise around a zero eigenvalue) into 0.0
     return {
-        "A": {"min": min_A, "max": max_A},
-        "L": {"min": min_L, "max": max_L},
-        "Q": {"min": min_Q, "max": max_Q},
+        name: {"min": round(float(lo), 6) + 0.0, "max": round(float(hi), 6) + 0.0}
+        for name, (lo, hi) in extremes.items()
     }
-    
-def graph_data_all_k(G) -> Dict:
-    """
-    Combine everything in one structure 
 
-        • basic_graph_data(G)
-        • graph_k_invariants(G, k)
-        • token_graph_spectrum(G, k)
 
-    The output has three top-level keys:
-      - "graph"   : NetworkX node-link JSON for G
-      - "basic_data" : {"W", "C", "M"} from basic_graph_data
-      - "k_data"  : mapping k ↦ {M_le_k, C_k, spec}
+def ensure_edge_weights(G: nx.Graph) -> None:
+    """Give every edge of G weight 1.0 if its edges carry no weights."""
+    if "weight" not in next(iter(G.edges(data=True)))[2]:
+        nx.set_edge_attributes(G, 1.0, name="weight")
 
-    Here  k  runs from 1 up to ⌊(n)/2⌋.
+
+def graph_data_summary(G: nx.Graph, context: GraphContext = None) -> Dict:
+    """
+    graph_data_all_k(G) without the token-graph spectra: "graph",
+    "graph_invariants" and "k_data" mapping k ↦ {M_le_k, C_k}. The cut and
+    matching profiles come from context (a new GraphContext if not given).
     """
     # ensure every edge carries a numeric weight
-    if "weight" not in next(iter(G.edges(data=True)))[2]:
-        nx.set_edge_attributes(G, 1.0, name="weight")
+    ensure_edge_weights(G)
+    if context is None:
+        context = GraphContext(G)
     
     n        = G.number_of_nodes()
     max_k    = (n) // 2
@@ -151,14 +181,125 @@ def graph_data_all_k(G) -> Dict:
     # graph-level metrics 
     summary  = {
         "graph":   node_link_data(G, edges="edges"),          # topology + weights
-        "graph_invariants": graph_invariant_data(G),        # W, C, M
+        "graph_invariants": graph_invariant_data(G, context=context),        # W, C, M
         "k_data":  {}
     }
 
     # per-k data
     for k in range(1, max_k + 1):
-        k_dict = graph_k_invariants(G, k)      # M_le_k, C_k
-        k_dict["spec"] = token_graph_spectrum(G, k)   # eigenvalue mins/maxs
-        summary["k_data"][k] = k_dict
+        summary["k_data"][k] = graph_k_invariants(G, k, context=context)      # M_le_k, C_k
+
+    return summary
+
+
+def fallback_token_graph_spectrum(G: nx.Graph, k: int, context: GraphContext = None) -> Dict:
+    """
+    token_graph_spectrum for a retry after the regular solve failed or timed
+    out: dense up to FALLBACK_DENSE_MAX_DIM, ARPACK with FALLBACK_TOL beyond.
+    """
+    return token_graph_spectrum(G, k, "auto", dense_max_dim=FALLBACK_DENSE_MAX_DIM,
+                                context=context, tol=FALLBACK_TOL)
+
+
+def graph_data_all_k(G, backend: str = "auto", context: GraphContext = None, fallback: bool = False) -> Dict:
+    """
+    Combine everything in one structure 
+
+        • basic_graph_data(G)
+        • graph_k_invariants(G, k)
+        • token_graph_spectrum(G, k)
+
+    The output has three top-level keys:
+      - "graph"   : NetworkX node-link JSON for G
+      - "basic_data" : {"W", "C", "M"} from basic_graph_data
+      - "k_data"  : mapping k ↦ {M_le_k, C_k, spec}
+
+    Here  k  runs from 1 up to ⌊(n)/2⌋. backend is passed on to
+    token_graph_spectrum. context caches the per-graph intermediates (matching,
+    cut and matching profiles, pair weights) so that each is computed once;
+    a fresh GraphContext is used if none is given. With fallback the spectra
+    come from fallback_token_graph_spectrum instead.
+    """
+    if context is None:
+        context = GraphContext(G)
+    summary = graph_data_summary(G, context)
+    for k, k_dict in summary["k_data"].items():
+        if fallback:
+            k_dict["spec"] = fallback_token_graph_spectrum(G, k, context)
+        else:
+            k_dict["spec"] = token_graph_spectrum(G, k, backend, context=context)   # eigenvalue mins/maxs
 
     return summary
+
+
+def graph_data_part(G: nx.Graph, part, backend: str = "auto", context: GraphContext = None,
+                    fallback: bool = False) -> Dict:
+    """
+    One independently computable piece of graph_data_all_k(G): the
+    graph_data_summary for part == "summary", otherwise the token_graph_spectrum
+    (fallback_token_graph_spectrum with fallback) of the part-token graph. Put
+    the pieces back together with assemble_graph_data.
+    """
+    ensure_edge_weights(G)
+    if context is None:
+        context = GraphContext(G)
+    if part == "summary":
+        return graph_data_summary(G, context)
+    if fallback:
+        return fallback_token_graph_spectrum(G, part, context)
+    return token_graph_spectrum(G, part, backend, context=context)
+
+
+def assemble_graph_data(summary: Dict, spectra: Dict[int, Dict]) -> Dict:
+    """
+    The graph_data_all_k record from graph_data_part pieces: the summary and
+    spectra mapping k ↦ spectrum for every k of the summary.
+    """
+    for k, k_dict in summary["k_data"].items():
+        k_dict["spec"] = spectra[k]
+    return summary
+
+
+def graph_data_batch(graphs: List[nx.Graph], backend: str = "auto",
+                     stage_times: Dict[str, float] = None) -> List[Dict]:
+    """
+    graph_data_all_k for a list of graphs. Cut profiles of graphs of the same
+    order come from one get_cut_profiles kernel call, and every (n, k) whose
+    token graph is solved densely is grouped across the whole list and handed
+    to stacked_token_graph_extreme_eigvals, so each group costs one vectorized
+    eigvalsh per matrix type instead of one solver call per graph. The records
+    are identical to those of graph_data_all_k.
+
+    If stage_times is given, the seconds spent on the "invariants" (W, C, M,
+    M_le_k, C_k) and "spectra" stages are added to it.
+    """
+    start = time.perf_counter()
+    contexts = []
+    for G in graphs:
+        ensure_edge_weights(G)
+        contexts.append(GraphContext(G))
+    for context, profile in zip(contexts, get_cut_profiles(graphs)):    # one bit-matrix product per order
+        context.cut_profile = profile
+    summaries = [graph_data_summary(G, context) for G, context in zip(graphs, contexts)]
+    invariants_done = time.perf_counter()
+
+    dense_groups = {}
+    for i, G in enumerate(graphs):
+        n = G.number_of_nodes()
+        for k, k_dict in summaries[i]["k_data"].items():
+            solver = select_solver(comb(n, k)) if backend == "auto" else backend
+            if solver == "dense":
+                dense_groups.setdefault((n, k), []).append(i)
+            else:
+                k_dict["spec"] = token_graph_spectrum(G, k, solver, context=contexts[i])
+
+    for (n, k), indices in dense_groups.items():
+        extremes = stacked_token_graph_extreme_eigvals([graphs[i] for i in indices], k,
+                                                       contexts=[contexts[i] for i in indices])
+        for i, graph_extremes in zip(indices, extremes):
+            summaries[i]["k_data"][k]["spec"] = format_spectrum(graph_extremes)
+
+    if stage_times is not None:
+        stage_times["invariants"] = stage_times.get("invariants", 0.0) + invariants_done - start
+        stage_times["spectra"] = stage_times.get("spectra", 0.0) + time.perf_counter() - invariants_done
+    return summaries